@@ -0,0 +1,239 @@
+# Admission control for model calls.
+#
+# Without a cap, a traffic spike turns into as many simultaneous Gemini calls as
+# there are requests, Vertex starts answering with quota errors, and every one of
+# those requests ends in a 500. AdmissionController sits in front of the model:
+#   - at most `concurrency` calls in flight per process
+#   - at most `qps` calls started per second (a token bucket holding `burst` tokens;
+#     qps=0 turns the rate limit off)
+#   - callers that can't start straight away wait in a FIFO queue of at most
+#     `max_queue`, for at most `queue_timeout` seconds
+# A caller that would overflow the queue, or can't be admitted in time, gets
+# ModelOverloaded at once with a Retry-After estimate, which the routes turn into
+# a 503 rather than letting requests pile up behind a saturated model.
+#
+# The same controller serves threads (acquire) and event loops (acquire_async), so
+# the limits hold across the Flask routes, the job workers and the ASGI app.
+
+import asyncio
+import collections
+import math
+import threading
+import time
+
+import metrics
+
+
+class ModelOverloaded(Exception):
+    """
+    The model can't take this call now. status is the HTTP status to answer with
+    (503 when our own queue is full, 429 when the provider's quota is exhausted) and
+    retry_after the suggested wait in seconds.
+    """
+
+    def __init__(self, message, retry_after, status=503):
+        super().__init__(message)
+        self.retry_after = retry_after
+        self.status = status
+
+
+class _Waiter:
+    def __init__(self, wake):
+        self.wake = wake
+        self.granted = False
+
+
+class AdmissionController:
+    """
+    acquire()/acquire_async() block until the call may start (or raise
+    ModelOverloaded) and return a handle to pass to release() once the call is over.
+    """
+
+    def __init__(self, concurrency, qps=0.0, burst=None, max_queue=64, queue_timeout=10.0):
+        self.concurrency = max(1, concurrency)
+        self.qps = max(0.0, qps)
+        self.burst = max(1.0, burst if burst is not None else self.qps)
+        self.max_queue = max(0, max_queue)
+        self.queue_timeout = queue_timeout
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._waiting = 0
+        self._waiters = collections.deque()
+        self._tokens = self.burst
+        self._refilled = time.monotonic()
+        # Moving average of how long a call holds its slot, for Retry-After
+        self._hold_time = 1.0
+        self.admitted = 0
+        self.rejected = 0
+
+    def _refill(self, now):
+        if self.qps:
+            self._tokens = min(self.burst, self._tokens + (now - self._refilled) * self.qps)
+            self._refilled = now
+
+    def _token_delay(self):
+        # Tokens go negative for reservations, so this also counts callers ahead of us
+        if not self.qps or self._tokens >= 1:
+            return 0.0
+        return (1 - self._tokens) / self.qps
+
+    def retry_after(self):
+        """Rough seconds until a newly queued call would start."""
+        estimate = self._hold_time * (self._waiting + 1) / self.concurrency
+        if self.qps:
+            estimate = max(estimate, (self._waiting + 1 - self._tokens) / self.qps)
+        return max(1, math.ceil(estimate))
+
+    def _reject(self, message):
+        self.rejected += 1
+        metrics.increment("model_admission_rejected")
+        return ModelOverloaded(message, self.retry_after())
+
+    def _enter(self, timeout):
+        """
+        Admit at once if a slot and a token are free. Otherwise join the queue:
+        returns (token_delay, deadline), or raises if the queue is full or the
+        token bucket can't supply a token before the deadline.
+        """
+        timeout = self.queue_timeout if timeout is None else min(timeout, self.queue_timeout)
+        now = time.monotonic()
+        with self._lock:
+            self._refill(now)
+            delay = self._token_delay()
+            if delay == 0 and self._in_flight < self.concurrency and not self._waiters:
+                if self.qps:
+                    self._tokens -= 1
+                self._in_flight += 1
+                self.admitted += 1
+                return None
+            if self._waiting >= self.max_queue:
+                raise self._reject("Model is at capacity; try again shortly")
+            if delay > timeout:
+                raise self._reject("Model call rate limit reached; try again shortly")
+            if self.qps:
+                self._tokens -= 1
+            self._waiting += 1
+        return delay, now + timeout
+
+    def _try_slot(self, wake):
+        """Take a free slot, or queue a waiter that wake() is called for once it has one."""
+        with self._lock:
+            if self._in_flight < self.concurrency and not self._waiters:
+                self._in_flight += 1
+                return None
+            waiter = _Waiter(wake)
+            self._waiters.append(waiter)
+            return waiter
+
+    def _abandon(self, waiter):
+        """A waiter gave up. True if it was granted a slot in the meantime (and now holds it)."""
+        with self._lock:
+            if waiter.granted:
+                return True
+            self._waiters.remove(waiter)
+            return False
+
+    def _admitted(self, start):
+        with self._lock:
+            self._waiting -= 1
+            self.admitted += 1
+        metrics.record("admission_wait", time.monotonic() - start)
+
+    def _left_queue(self):
+        with self._lock:
+            self._waiting -= 1
+
+    def acquire(self, timeout=None):
+        start = time.monotonic()
+        queued = self._enter(timeout)
+        if queued is None:
+            return start
+        delay, deadline = queued
+        try:
+            if delay:
+                time.sleep(delay)
+            event = threading.Event()
+            waiter = self._try_slot(event.set)
+            if waiter is not None and not event.wait(max(0.0, deadline - time.monotonic())):
+                if not self._abandon(waiter):
+                    with self._lock:
+                        raise self._reject("Timed out waiting for a model slot")
+        except BaseException:
+            self._left_queue()
+            raise
+        self._admitted(start)
+        return time.monotonic()
+
+    async def acquire_async(self, timeout=None):
+        start = time.monotonic()
+        queued = self._enter(timeout)
+        if queued is None:
+            return start
+        delay, deadline = queued
+        try:
+            if delay:
+                await asyncio.sleep(delay)
+            loop = asyncio.get_running_loop()
+            future = loop.create_future()
+
+            def wake():
+                # release() may run on another thread
+                loop.call_soon_threadsafe(lambda: future.done() or future.set_result(None))
+
+            waiter = self._try_slot(wake)
+            if waiter is not None:
+                try:
+                    await asyncio.wait_for(future, max(0.0, deadline - time.monotonic()))
+                except asyncio.TimeoutError:
+                    if not self._abandon(waiter):
+                        with self._lock:
+                            raise self._reject("Timed out waiting for a model slot")
+                except asyncio.CancelledError:
+                    if self._abandon(waiter):
+                        self.release(None)
+                    raise
+        except BaseException:
+            self._left_queue()
+            raise
+        self._admitted(start)
+        return time.monotonic()
+
+    def release(self, admitted_at):
+        """Free the slot taken by acquire(); hands it straight to the next waiter, if any."""
+        with self._lock:
+            if admitted_at is not None:
+                held = time.monotonic() - admitted_at
+                self._hold_time += 0.2 * (held - self._hold_time)
+            if self._waiters:
+                waiter = self._waiters.popleft()
+                waiter.granted = True
+                waiter.wake()
+            else:
+                self._in_flight -= 1
+
+    def reserve_token(self, deadline):
+        """
+        Reserve a rate-limit token without queueing for a slot (for retries by a
+        caller that already holds one). Returns the seconds to wait before using
+        it; raises ModelOverloaded if it wouldn't come before the deadline.
+        """
+        now = time.monotonic()
+        with self._lock:
+            self._refill(now)
+            delay = self._token_delay()
+            if now + delay > deadline:
+                raise self._reject("Model call rate limit reached; try again shortly")
+            if self.qps:
+                self._tokens -= 1
+        return delay
+
+    def stats(self):
+        with self._lock:
+            return {
+                "in_flight": self._in_flight,
+                "waiting": self._waiting,
+                "concurrency": self.concurrency,
+                "qps": self.qps,
+                "admitted": self.admitted,
+                "rejected": self.rejected,
+            }
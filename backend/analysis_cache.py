@@ -0,0 +1,234 @@
+# Result cache for /api/analyze-image.
+#
+# Clients re-send the same photo all the time (retries, the app re-uploading), and
+# each upload costs a full Gemini call. We cache the parsed model output (the list
+# of detected foods) keyed by the image and finger_length; on a hit the route only
+# re-runs the carbon calculation.
+#
+# Entries are stored under the SHA-256 of the image bytes for exact repeats, and
+# under a 64-bit difference hash (dHash) of the pixels so a re-encoded or resized
+# copy of the same photo still hits. Re-encoding flips a few dHash bits, so the
+# dHash is split into four 16-bit bands, each stored as its own key; a lookup
+# checks every band and accepts a candidate within MAX_HASH_DISTANCE bits. Any
+# copy within 3 bits is guaranteed to share at least one band.
+#
+# Configured with environment variables:
+#   ANALYSIS_CACHE_BACKEND   memory (default), sqlite or off
+#   ANALYSIS_CACHE_SIZE      max entries before LRU eviction (default 1024)
+#   ANALYSIS_CACHE_TTL       seconds an entry stays valid (default 86400)
+#   ANALYSIS_CACHE_PATH      SQLite file for the sqlite backend (default analysis_cache.sqlite3)
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from io import BytesIO
+
+
+MAX_HASH_DISTANCE = 6
+
+
+def content_hash(image_bytes):
+    return hashlib.sha256(image_bytes).hexdigest()
+
+
+def perceptual_hash(image_bytes):
+    """64-bit dHash of the image as a hex string, or None if it can't be decoded."""
+    from PIL import Image  # deferred so importing the app doesn't load Pillow
+
+    try:
+        img = Image.open(BytesIO(image_bytes))
+        # Let JPEG decode at reduced scale; we only need a 9x8 thumbnail
+        img.draft("L", (64, 64))
+        pixels = list(img.convert("L").resize((9, 8), Image.LANCZOS).getdata())
+    except Exception:
+        return None
+
+    bits = 0
+    for row in range(8):
+        for col in range(8):
+            left = pixels[row * 9 + col]
+            right = pixels[row * 9 + col + 1]
+            bits = (bits << 1) | (left > right)
+    return f"{bits:016x}"
+
+
+def hash_distance(a, b):
+    """Number of differing bits between two hex dHashes."""
+    return bin(int(a, 16) ^ int(b, 16)).count("1")
+
+
+class MemoryCache:
+    """In-process LRU cache with a per-entry TTL."""
+
+    def __init__(self, max_entries=1024, ttl=86400):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires < time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.time() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class SQLiteCache:
+    """On-disk LRU cache with a per-entry TTL, shared by every worker on the host."""
+
+    def __init__(self, path="analysis_cache.sqlite3", max_entries=1024, ttl=86400):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS analysis_cache ("
+                " key TEXT PRIMARY KEY, value TEXT NOT NULL,"
+                " expires REAL NOT NULL, last_used REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS analysis_cache_lru ON analysis_cache (last_used)")
+
+    def _connect(self):
+        # sqlite3 connections can't be shared across threads, so keep one per thread
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key):
+        now = time.time()
+        with self._connect() as conn:
+            row = conn.execute("SELECT value, expires FROM analysis_cache WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            value, expires = row
+            if expires < now:
+                conn.execute("DELETE FROM analysis_cache WHERE key = ?", (key,))
+                return None
+            conn.execute("UPDATE analysis_cache SET last_used = ? WHERE key = ?", (now, key))
+        return json.loads(value)
+
+    def set(self, key, value):
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO analysis_cache (key, value, expires, last_used) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(value), now + self.ttl, now),
+            )
+            conn.execute(
+                "DELETE FROM analysis_cache WHERE key IN ("
+                " SELECT key FROM analysis_cache ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+
+    def __len__(self):
+        return self._connect().execute("SELECT COUNT(*) FROM analysis_cache").fetchone()[0]
+
+
+class AnalysisCache:
+    """Looks up model output by exact image hash, then by perceptual hash."""
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.hits = 0
+        self.perceptual_hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _exact_key(image_bytes, finger_length):
+        return f"sha256:{content_hash(image_bytes)}:{finger_length}"
+
+    @staticmethod
+    def _band_keys(phash, finger_length):
+        return [f"dhash{band}:{phash[band * 4:band * 4 + 4]}:{finger_length}" for band in range(4)]
+
+    def get(self, image_bytes, finger_length):
+        value = self.backend.get(self._exact_key(image_bytes, finger_length))
+        perceptual = False
+        if value is None:
+            # Only decode for the perceptual hash when the cheap exact lookup misses
+            phash = perceptual_hash(image_bytes)
+            if phash is not None:
+                for key in self._band_keys(phash, finger_length):
+                    entry = self.backend.get(key)
+                    if entry is not None and hash_distance(entry["dhash"], phash) <= MAX_HASH_DISTANCE:
+                        value = entry["value"]
+                        perceptual = True
+                        break
+
+        with self._lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self.perceptual_hits += perceptual
+        return value
+
+    def put(self, image_bytes, finger_length, value):
+        self.backend.set(self._exact_key(image_bytes, finger_length), value)
+        phash = perceptual_hash(image_bytes)
+        if phash is not None:
+            for key in self._band_keys(phash, finger_length):
+                self.backend.set(key, {"dhash": phash, "value": value})
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "backend": type(self.backend).__name__,
+            "entries": len(self.backend),
+            "hits": self.hits,
+            "perceptual_hits": self.perceptual_hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+
+class NullCache:
+    """Stand-in used when caching is turned off."""
+
+    def get(self, image_bytes, finger_length):
+        return None
+
+    def put(self, image_bytes, finger_length, value):
+        pass
+
+    def stats(self):
+        return {"backend": None}
+
+
+def make_analysis_cache():
+    """Build the cache described by the ANALYSIS_CACHE_* environment variables."""
+    kind = os.environ.get("ANALYSIS_CACHE_BACKEND", "memory").lower()
+    max_entries = int(os.environ.get("ANALYSIS_CACHE_SIZE", "1024"))
+    ttl = float(os.environ.get("ANALYSIS_CACHE_TTL", "86400"))
+
+    if kind == "off":
+        return NullCache()
+    if kind == "sqlite":
+        path = os.environ.get("ANALYSIS_CACHE_PATH", "analysis_cache.sqlite3")
+        return AnalysisCache(SQLiteCache(path, max_entries=max_entries, ttl=ttl))
+    return AnalysisCache(MemoryCache(max_entries=max_entries, ttl=ttl))
@@ -1,611 +1,131 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Request, Response, request, jsonify, url_for
 from flask_cors import CORS
+import concurrent.futures
 import json
 import os
 import tempfile
-from PIL import Image
-
-from werkzeug.utils import secure_filename
+import threading
+import tracemalloc
 from io import BytesIO
 
-# Optional HEIC support (install: pip install pillow-heif)
-try:
-    import pillow_heif
-    pillow_heif.register_heif_opener()
-except Exception:
-    pass  # If not installed, we'll still handle most cases via Pillow
-
-
+from werkzeug.exceptions import RequestEntityTooLarge
+from werkzeug.utils import secure_filename
 
-import vertexai
-from vertexai.generative_models import GenerativeModel, Part
-import pandas as pd
+# The Vertex SDK, pandas and Pillow (+ pillow_heif) take seconds to import between
+# them, so nothing here imports them at module level: they load in warm_up(),
+# which runs after the app object exists. See CARBONFORK_WARMUP below.
+from analysis_cache import content_hash, make_analysis_cache
+from job_queue import JobError, make_job_queue
+import logs
+import metrics
+import model_runner
+from model_output import FOOD_SCHEMA, FoodStreamParser, coerce_food, parse_foods, repair_contents
+from model_runner import ModelOverloaded, ModelTimeout, TextResponse
+from single_flight import SingleFlight
+
+# Uploads above MAX_UPLOAD_BYTES are rejected with a 413 before they're read in full.
+# Anything above UPLOAD_SPOOL_BYTES is spooled to a temp file instead of held in memory.
+MAX_UPLOAD_BYTES = int(os.environ.get("MAX_UPLOAD_BYTES", str(25 * 1024 * 1024)))
+UPLOAD_SPOOL_BYTES = int(os.environ.get("UPLOAD_SPOOL_BYTES", str(1024 * 1024)))
+# Set TRACE_UPLOAD_MEMORY=1 to record each analyze request's peak Python allocations
+TRACE_UPLOAD_MEMORY = os.environ.get("TRACE_UPLOAD_MEMORY") == "1"
+
+# /api/analyze-batch limits: images per request, parallel preprocessing, model calls in flight
+BATCH_MAX_IMAGES = int(os.environ.get("BATCH_MAX_IMAGES", "20"))
+BATCH_PREPROCESS_WORKERS = int(os.environ.get("BATCH_PREPROCESS_WORKERS", str(os.cpu_count() or 2)))
+BATCH_MODEL_CONCURRENCY = int(os.environ.get("BATCH_MODEL_CONCURRENCY", "4"))
+
+# Minimum trigram similarity (0-1) for a fuzzy food-name match to be used
+# (default EmissionsIndex.THRESHOLD)
+FUZZY_MATCH_THRESHOLD = float(os.environ["FUZZY_MATCH_THRESHOLD"]) if os.environ.get("FUZZY_MATCH_THRESHOLD") else None
+# How many distinct model labels to remember the resolved emissions row for
+NAME_CACHE_SIZE = int(os.environ.get("NAME_CACHE_SIZE", "4096"))
+# Seconds between checks for an updated emissions CSV; 0 turns hot reload off
+EMISSIONS_RELOAD_INTERVAL = float(os.environ.get("EMISSIONS_RELOAD_INTERVAL", "30"))
+# Set MODEL_OUTPUT_REPAIR=0 to skip the text-only retry when a model reply can't be
+# parsed; MODEL_REPAIR_TIMEOUT bounds that retry (seconds)
+MODEL_OUTPUT_REPAIR = os.environ.get("MODEL_OUTPUT_REPAIR", "1") != "0"
+MODEL_REPAIR_TIMEOUT = float(os.environ.get("MODEL_REPAIR_TIMEOUT", "30"))
+logs.configure()
+logger = logs.get_logger("app")
+
+# When to load the heavy dependencies and the emissions data:
+#   background  start a warm-up thread at import; the first requests that need it wait
+#   eager       warm up during import (gunicorn preload sets this, so it runs pre-fork)
+#   lazy        warm up on the first request that needs it
+CARBONFORK_WARMUP = os.environ.get("CARBONFORK_WARMUP", "background").lower()
+
+
+class UploadRequest(Request):
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        # Multipart file parts go to a spooled temp file past the threshold
+        return tempfile.SpooledTemporaryFile(max_size=UPLOAD_SPOOL_BYTES, mode="rb+")
 
-import mimetypes
 
 # Load environment variables
 app = Flask(__name__)
+app.request_class = UploadRequest
+app.config['MAX_CONTENT_LENGTH'] = MAX_UPLOAD_BYTES
 CORS(app, resources={r"/api/*": {"origins": "*"}})
 
+if TRACE_UPLOAD_MEMORY:
+    tracemalloc.start()
 
-vertexai.init(project="carbonfork", location="us-central1")
 
-try:
-    carbon_data = pd.read_csv('../longerEmissions.csv')
-    # Drop the entity column because we don't need it
-    carbon_data = carbon_data.drop('Entity', axis=1)
-    
-    # Process CO2e values to get middle point between ranges
-    for index, row in carbon_data.iterrows():
-        value = row["CO2e"]
-        if isinstance(value, str) and "-" in value:
-            value_parts = value.split('-')
-            value_low = float(value_parts[0])
-            value_high = float(value_parts[1])
-            if value_high != value_low:
-                value_new = value_high - ((value_high - value_low)/2)
-            else:
-                value_new = value_high
-            carbon_data.at[index, "CO2e"] = value_new
-    
-    print("Carbon data loaded successfully!")
-    print(carbon_data.head())
-except Exception as e:
-    print(f"Error loading carbon data: {e}")
-    carbon_data = None
-
-list_text = """
-Beef
-Dark chocolate
-Lamb
-Coffee
-Shrimp
-Cheese
-Fish
-Pork
-Chicken
-Egg
-Rice
-Peanut
-Tofu
-Milk
-Oatmeal
-Wine
-Wheat
-Rye grains
-Berries
-Grape
-Pea
-Potato
-Apple
-Barley
-Cassava
-Soymilk
-Soy oil
-Olive oil
-Onion
-Leeks
-Sugar
-Beer
-Bottled water
-Mineral water
-Breakfast cereal
-Crackers
-Egg pasta
-Frozen raspberries
-Ice cream
-Margarine
-Dried pasta
-Pesto
-Tomato purée
-Tomato sauce
-Dried yeast
-Boneless beef
-Bone in beef
-Butter
-Fresh cheese
-Hard cheese
-Honey
-Boneless lambs
-Bone in lambs
-Boneless pork
-Bone in pork
-Boneless poultry
-Bone in poultry
-Snails
-Yogurt
-Mushroom
-Seed
-Frozen fishes
-Tapioca
-Sweet potatoes
-Yukon gold potatoes
-Buffalo
-Rabbit
-Plain bread
-Whole bread
-Plain crackers
-Orange juice
-Croissant
-Cream
-Mozzarella cheese
-Cheddar cheese
-Ham
-Boneless chickens
-Boneless turkey
-Bone in chickens
-Lactose free yogurt
-Plain yogurt
-Raisins
-Strawberries
-Avocado
-Banana
-Pineapple
-Melon
-Mandarin
-Orange
-Apricot
-Cherry
-Kiwifruit
-Mango
-Peach
-Nectarine
-Pear
-Quince
-Olive
-Blueberry
-Oat
-Quinoa
-Cowpea
-Green bean
-Soy
-Almond
-Cashew
-Hazelnut
-Pistachio nuts
-Walnut
-Gherkin
-Lettuce
-Pepper
-Tomato
-Asparagus
-Cabbage
-Spinach
-Carrot
-Broccoli
-Cauliflower
-Cucumber
-Eggplant
-Pumpkin
-Zucchini
-Anchovy
-Cod fishes
-Hake
-Mackerel
-Salmon
-Sardine
-Sea bass
-Seatrout
-Tuna
-Herring
-Lobster
-Mussel
-Tea
-Durum flour
-Sorghum flour
-Chocolate
-Vanilla extract
-Soymeal
-Canned beans
-Beans
-Peanut butter
-Peanut oil
-Peeled tomatoes
-Milk chocolate
-Espresso
-Ketchup
-Mayonnaise
-Raspberries
-Apple juice
-Mango juice
-Pineapple juice
-Canned carrots
-Canned corn
-Almondmilk
-Coconut milk
-White wine
-Ricotta cheese
-Asiago cheese
-Camembert cheese
-Emmental cheese
-Goat cheese
-Grana Padano cheese
-Parmesan cheese
-Pecorino cheese
-Goat milk
-Bacon
-Merguez
-Sausage
-Duck
-Date
-Coconut
-Pomegranate
-Clementine
-Lemon
-Lime
-Carob
-Fig
-Guava
-Plum
-Watermelon
-Blackberry
-Cranberry
-Currant
-Goose
-Clementine
-Lemon
-Lime
-Carob
-Fig
-Guava
-Plum
-Watermelon
-Blackberry
-Cranberry
-Currant
-Gooseberry
-Chickpea
-Lentil
-Chestnut
-Mix nuts
-Sesame
-Sunflower seeds
-Ginger
-Garlic
-Radish
-Rutabaga
-Salsify
-Turnip
-Artichoke
-Celery
-Celeriac
-Monkfish
-Carp
-Catfish
-Haddock
-Ling fishes
-Beef tongue
-Plaice
-Cervelat
-Pollock
-Sharks
-Sole
-Swordfish
-Turbot
-Whiting
-Stick fishes
-Octopus
-Calamari
-Agar seaweed
-Dill
-Pizza sauce
-Basil
-Baking soda
-Cinnamon
-Ground cinnamon
-Cardamom
-Ground cardamom
-Chervil
-Chives
-Clove
-Coriander seed
-Chili peppers
-Grapefruit
-Cantaloupe
-Bass
-Turkey
-Veal
-Lima beans
-French beans
-Pinto beans
-Millet
-Sea salt
-Herb
-Spice
-Mustard
-Parsley
-Rosemary
-Thyme
-Vinegar
-Sage
-Saffron
-Syrup
-Baby food
-Oat milk
-Coconut water
-Energy drink
-Champagne
-Cider
-Cocktail
-Cola drink
-Liqueur
-Gin
-Carrot juice
-Lemon juice
-Grape juice
-Tomato juice
-Juice
-Nectar
-Cocoa
-Rum
-Sake
-Red wine
-Vodka
-Whiskey
-Fishes sandwiches
-Chicken sandwiches
-Vegetarian hamburgers
-Cheeseburger
-Sauerkraut
-Crepe
-Fajita
-Falafel
-Hamburger
-Frankfurter
-Lasagne
-Egg rolls
-Ravioli
-Meats pizzas
-Cheeses pizzas
-Vegetable pizzas
-Margherita pizzas
-Lorraine quiches
-Risotto
-Stir-fried rice
-Caesar salad
-Coleslaw
-Potato salad
-Tuna salad
-Soufflé
-Vegetable soup
-Mushroom soup
-Lentil soup
-Chicken soup
-Minestrone soup
-Split pea soup
-Sushi
-Tripe
-Bamboo shoots
-Plantain
-Swiss chard
-Morel mushrooms
-Potato chip
-Bok choy
-Brussels sprouts
-Kale
-Kohlrabi
-Butternut squashes
-Squashes
-Cress
-Watercress
-Shallot
-Broad beans
-Prickly pears
-French fries
-Passion fruits
-Okra
-Navy beans
-Kidney red beans
-Persimmon
-Kumquat
-Mixed vegetables
-Flax seeds
-Lychee
-Cocktail fruits
-Sweet corn
-Macadamia
-Pecans
-Brazil nuts
-Sorrel
-Parsnip
-Papaya
-Marzipan
-Dried peaches
-Pine nuts
-Split peas
-Sweet pepper
-Mashed potatoes
-Dried apples
-Prunes
-Rhubarb
-Arugula
-Escarole
-Elderberries
-Tahini
-Tamarind
-Taro
-Tomato paste
-Sun-dried tomatoes
-Sorbet
-Ice pops
-Frozen yogurt
-Custard
-Blue cheese
-Soy sauce
-Maple syrup
-Bran
-Brie cheese
-Cheesecake
-Chocolate cakes
-Lemon cakes
-Whipped cream
-Edam cheese
-Feta cheese
-Fontina cheese
-Cream cheese
-Gorgonzola cheese
-Gouda cheese
-Gruyere cheese
-Condensed milk
-1% milk fat milk
-Skim milk
-3.25% milk fat milk
-Kefir
-Dry milk
-Milkshake
-Meringue
-Muenster cheese
-Neufchatel cheese
-French toast
-Provolone cheese
-Roquefort cheese
-Tiramisu
-Chicken nuggets
-Snapper
-Surimi
-Dry sausages
-Chicken sausages
-Turkey sausages
-Salami
-Dogfish
-Beef kidney
-Protein fortified soy
-Pork belly
-Pork chop
-Pork loin
-Pork shoulder
-Pork roast
-Pork spare rib
-Breaded fishes
-Guineafowls
-Perch
-Scallops
-Pate
-Pancetta
-Omelet
-Goose
-Mullet
-Mutton
-Salted cod fishes
-Mortadella
-Grouper
-Oyster
-Smoked haddocks
-Ground turkey
-Ground chickens
-Ground beef
-Chicken liver
-Pork liver
-Beef liver
-Lamb livers
-Halibut
-Pheasant
-Smelts
-Crab
-Muesli
-Cookies
-Chocolate cookies
-Gnocchi
-Croutons
-Spelt
-Brioche
-Brownies
-Fruitcake
-Doughnuts
-Goat
-Beef heart
-Quail
-Granulated sugar
-Brown sugar
-Molasses
-Marshmallows
-Jam
-White chocolate
-Hard candy
-Lollipops
-Greek yogurt
-Rice noodles
-Tortillas
-Apple pies
-Shortbread cookies
-Buckwheat
-Wild rice
-Basmati rice
-Popcorn
-Pound cakes
-Polenta
-Phyllo
-Puff pastry
-Rye flour
-Rice flour
-Chickpea flour
-Barley flour
-Wheat flour
-Corn flour
-Couscous
-Corn chips
-Tortilla chips
-Whole wheat
-Bulgur
-Bagels
-Cornstarch
-Amaranth
-Cumin
-Turmeric
-Curry powder
-Tarragon
-Fennel seeds
-Fenugreek seed
-Dried marjoram
-Fresh mint
-Nutmeg
-Dried oregano
-Paprika
-Poppyseed
-Black peppercorn
-Cayenne
-Salad dressing
-Chia seed
-Light cream
-Vegetable oil
-Avocado oil
-Cod liver oil
-Herring oil
-Corn oil
-Hazelnut oil
-Grapeseed oil
-Sardine oil
-Salmon oil
-Sesame oil
-Corn
-English muffins
-Blueberry muffins
-Chocolate croissants
-French bread
-Rye bread
-Gingerbread
-Pita
-Hamburger buns
-Hot dog buns
-Baguette
-Pizza dough
-Brown rice
-Steak flanks
-Beef rib
-Beef sirloin
-Round beef
-Beef chuck
-Beef short rib
-Chicken wings
-Chicken legs
-Chicken breasts
-Chicken drumsticks
-Chicken wholes
-Lamb legs
-Lamb chops
-Yellowfin tuna
-Albacore tuna
-"""
+# Parsed model output for photos we've already analyzed (see analysis_cache.py)
+analysis_cache = make_analysis_cache()
+
+# Model calls in progress, so concurrent requests for the same photo share one
+# (see single_flight.py)
+in_flight = SingleFlight()
+
+# Set by warm_up(): holds the current emissions snapshot (see emissions_store.py)
+emissions_store = None
+_warm_lock = threading.Lock()
+_warm_done = threading.Event()
+
+
+def warm_up():
+    """
+    Import the heavy dependencies, load the emissions data and create the Gemini
+    client. Runs once; concurrent callers wait for the first one to finish.
+    """
+    global emissions_store
+    if _warm_done.is_set():
+        return
+    with _warm_lock:
+        if _warm_done.is_set():
+            return
+        with metrics.timed("warm_up"):
+            import image_pipeline  # noqa: F401  Pillow and the HEIC plugin
+            from emissions_store import EmissionsStore
+
+            # Create the model backend (the shared Gemini client) now rather than
+            # on the first request
+            model_runner.warm_up()
+
+            # Each snapshot holds the Name + float64 CO2e table (memory-mapped from the
+            # compiled cache), its name index, the label resolution cache and the food
+            # list Gemini maps its labels onto. A watcher thread swaps in a new snapshot
+            # when the CSV changes.
+            store = EmissionsStore('../longerEmissions.csv', threshold=FUZZY_MATCH_THRESHOLD,
+                                   cache_size=NAME_CACHE_SIZE)
+            try:
+                store.load()
+                logger.info("Carbon data loaded (version %s, %d rows)", store.current.version,
+                            len(store.current.carbon_data))
+            except Exception as e:
+                logger.error("Error loading carbon data: %s", e)
+            store.start_watcher(EMISSIONS_RELOAD_INTERVAL)
+            emissions_store = store
+        _warm_done.set()
+
+
+if CARBONFORK_WARMUP == "eager":
+    warm_up()
+elif CARBONFORK_WARMUP == "background":
+    threading.Thread(target=warm_up, name="warm-up", daemon=True).start()
+
 
 @app.before_request
 def handle_preflight():
@@ -620,41 +140,111 @@ def handle_preflight():
 def home():
     return "Gemini Image Analysis API is running!"
 
-def calculate_carbon_footprint(food_items, weights):
-    """Calculate carbon footprint for given food items and weights"""
-    if carbon_data is None:
+@app.route('/healthz')
+def healthz():
+    # Liveness: answers as soon as the process is up, even while warming up
+    return jsonify({'status': 'ok'})
+
+@app.route('/readyz')
+def readyz():
+    # Readiness: 503 until the emissions data and model client are loaded
+    if not _warm_done.is_set():
+        return jsonify({'status': 'warming_up'}), 503
+    return jsonify({'status': 'ready', 'dataset_version': emissions_store.stats()['dataset_version']})
+
+@app.route('/metrics')
+def prometheus_metrics():
+    # Stage histograms and counters (see metrics.py) plus the caches' and job
+    # queue's own numbers, in the Prometheus text format
+    cache = analysis_cache.stats()
+    snapshot = emissions_store.current if emissions_store is not None else None
+    names = snapshot.resolver.stats() if snapshot is not None else {}
+    counters = {
+        'analysis_cache_hits': cache.get('hits', 0),
+        'analysis_cache_perceptual_hits': cache.get('perceptual_hits', 0),
+        'analysis_cache_misses': cache.get('misses', 0),
+        'name_cache_hits': names.get('hits', 0),
+        'name_cache_misses': names.get('misses', 0),
+    }
+    gauges = {'analysis_cache_entries': cache.get('entries'), 'name_cache_entries': names.get('entries'),
+              'analyses_in_flight': in_flight.stats()['in_flight']}
+    try:
+        jobs = job_queue.stats()
+        gauges.update(job_queue_depth=jobs['queue_depth'], jobs_running=jobs['running'])
+    except Exception as e:
+        logger.warning("Job queue stats unavailable: %s", e)
+    admission = model_runner.admission.stats()
+    gauges.update(model_calls_in_flight=admission['in_flight'], model_calls_waiting=admission['waiting'])
+    return Response(metrics.prometheus_text(counters, gauges), mimetype='text/plain; version=0.0.4')
+
+@app.route('/api/metrics')
+def latency_metrics():
+    # Per-stage latency: request_parse, decode, encode, client_setup, upload,
+    # admission_wait, inference, first_chunk (streamed), parse, carbon_lookup,
+    # serialize; plus per-request peak upload memory when TRACE_UPLOAD_MEMORY=1
+    counters = metrics.counter_snapshot()
+    parsed = counters.get('model_parse_ok', 0) + counters.get('model_parse_failed', 0)
+    return jsonify({
+        'latency': metrics.snapshot(),
+        'values': metrics.value_snapshot(),
+        'counters': counters,
+        'parse_failure_rate': round(counters.get('model_parse_failed', 0) / parsed, 4) if parsed else 0.0,
+        'admission': model_runner.admission.stats(),
+    })
+
+@app.route('/api/cache-stats')
+def cache_stats():
+    stats = analysis_cache.stats()
+    snapshot = emissions_store.current if emissions_store is not None else None
+    stats['name_resolution'] = snapshot.resolver.stats() if snapshot is not None else None
+    stats['coalescing'] = in_flight.stats()
+    return jsonify(stats)
+
+@app.route('/api/dataset')
+def dataset_info():
+    warm_up()
+    return jsonify(emissions_store.stats())
+
+def current_emissions():
+    """The emissions snapshot to use for one request."""
+    warm_up()
+    snapshot = emissions_store.current
+    if snapshot is None:
         raise Exception("Carbon data not loaded")
+    return snapshot
+
+def calculate_carbon_footprint(food_items, weights, snapshot=None):
+    """Calculate carbon footprint for given food items and weights"""
+    snapshot = snapshot or current_emissions()
+    carbon_data = snapshot.carbon_data
     
     final_carbon = []
     food_details = []
     
     for i, item in enumerate(food_items):
         try:
-            # Look for exact match first
-            matching_rows = carbon_data[carbon_data['Name'].str.lower() == item.lower()]
-            
-            if matching_rows.empty:
-                # Try partial match if exact match fails
-                matching_rows = carbon_data[carbon_data['Name'].str.contains(item, case=False, na=False)]
-            
-            if not matching_rows.empty:
-                carbon_index = matching_rows.index[0]
-                carbon_value = carbon_data.at[carbon_index, 'CO2e']
+            # Exact match first, then the best fuzzy match above the threshold
+            match = snapshot.resolver.match(item)
+
+            if match is not None:
+                carbon_value = float(carbon_data.at[match.label, 'CO2e'])
                 
                 # Convert weight from grams to kg and calculate carbon footprint
                 weight_kg = weights[i] / 1000.0
-                carbon_footprint = weight_kg * float(carbon_value)
+                carbon_footprint = weight_kg * carbon_value
                 
                 final_carbon.append(carbon_footprint)
                 food_details.append({
                     'food_item': item,
                     'weight_grams': weights[i],
                     'weight_kg': weight_kg,
-                    'carbon_per_kg': float(carbon_value),
-                    'carbon_footprint_kg': carbon_footprint
+                    'carbon_per_kg': carbon_value,
+                    'carbon_footprint_kg': carbon_footprint,
+                    'matched_name': match.name,
+                    'match_score': round(match.score, 3)
                 })
             else:
-                print(f"Warning: Could not find carbon data for {item}")
+                logger.warning("Could not find carbon data for %r", item)
                 # Use a default value or skip
                 final_carbon.append(0)
                 food_details.append({
@@ -667,7 +257,7 @@ def calculate_carbon_footprint(food_items, weights):
                 })
                 
         except Exception as e:
-            print(f"Error processing {item}: {e}")
+            logger.error("Error processing %r: %s", item, e)
             final_carbon.append(0)
             food_details.append({
                 'food_item': item,
@@ -677,156 +267,247 @@ def calculate_carbon_footprint(food_items, weights):
     
     return final_carbon, food_details, sum(final_carbon)
 
-from flask import Flask, request, jsonify
-from flask_cors import CORS
-import json
-import os
-import tempfile
-import vertexai
-from vertexai.generative_models import GenerativeModel, Part
-import pandas as pd
-from PIL import Image # Import Pillow
+def calculate_carbon_footprint_batch(food_items, weights=None, snapshot=None):
+    """
+    Vectorized footprints for many (food, grams) pairs, e.g. for bulk recomputation.
+    Takes sequences or a DataFrame; returns (results DataFrame, diagnostics).
+    See emissions.calculate_footprints.
+    """
+    from emissions import calculate_footprints
 
-# ... (rest of your existing code remains the same)
+    snapshot = snapshot or current_emissions()
+    return calculate_footprints(snapshot.carbon_data, snapshot.resolver, food_items, weights)
+
+def calculate_carbon_footprint_vectorized(food_items, weights, snapshot=None):
+    """calculate_carbon_footprint's return value, computed through the batch API."""
+    results, _ = calculate_carbon_footprint_batch(food_items, weights, snapshot)
+
+    final_carbon = []
+    food_details = []
+    for i, row in enumerate(results.itertuples(index=False)):
+        if not isinstance(row.food_item, str) or row.weight_kg != row.weight_kg:
+            final_carbon.append(0)
+            food_details.append({
+                'food_item': food_items[i],
+                'weight_grams': weights[i],
+                'error': 'Invalid food name or weight'
+            })
+        elif row.matched:
+            final_carbon.append(row.carbon_footprint_kg)
+            food_details.append({
+                'food_item': food_items[i],
+                'weight_grams': weights[i],
+                'weight_kg': row.weight_kg,
+                'carbon_per_kg': row.carbon_per_kg,
+                'carbon_footprint_kg': row.carbon_footprint_kg,
+                'matched_name': row.matched_name,
+                'match_score': round(row.match_score, 3)
+            })
+        else:
+            final_carbon.append(0)
+            food_details.append({
+                'food_item': food_items[i],
+                'weight_grams': weights[i],
+                'weight_kg': row.weight_kg,
+                'carbon_per_kg': 0,
+                'carbon_footprint_kg': 0,
+                'note': 'Carbon data not found'
+            })
+
+    return final_carbon, food_details, sum(final_carbon)
+
+def normalize_image(source):
+    """image_pipeline.normalize_image, imported on first use since it pulls in Pillow."""
+    from image_pipeline import normalize_image as normalize
+    return normalize(source)
 
-ALLOWED_MODEL_MIMES = {"image/jpeg", "image/png"}
 
 def normalize_image_to_model_supported(image_file) -> tuple[bytes, str]:
     """
     Returns (image_bytes, mime) suitable for Vertex Gemini.
-    We convert anything that isn't a clean JPEG/PNG into JPEG.
+    See image_pipeline.normalize_image: clean JPEG/PNG uploads pass straight through,
+    anything else comes out upright, capped at IMAGE_MAX_EDGE and within the byte budget.
     """
     filename = secure_filename(image_file.filename or "upload")
-    raw_bytes = image_file.read()
-    image_file.seek(0)  # reset for safety if needed elsewhere
-
-    if not raw_bytes or len(raw_bytes) == 0:
-        raise ValueError("Uploaded image is empty (0 bytes).")
 
-    # Try to open via Pillow; this also fixes many incorrect content-types
+    # Hand Pillow the (spooled) upload stream rather than a bytes copy of it
     try:
-        img = Image.open(BytesIO(raw_bytes))
-        # If the format is already JPEG or PNG, re-encode to clean bytes to avoid oddities
-        fmt = (img.format or "").upper()
-        if fmt in {"JPEG", "JPG"}:
-            out = BytesIO()
-            if img.mode not in ("RGB", "L"):
-                img = img.convert("RGB")
-            img.save(out, format="JPEG", quality=92)
-            return out.getvalue(), "image/jpeg"
-        elif fmt == "PNG":
-            out = BytesIO()
-            # Preserve alpha by staying PNG
-            img.save(out, format="PNG", optimize=True)
-            return out.getvalue(), "image/png"
-        else:
-            # Anything else (HEIC/WEBP/GIF/TIFF/unknown) -> convert to JPEG
-            if img.mode not in ("RGB", "L"):
-                img = img.convert("RGB")
-            out = BytesIO()
-            img.save(out, format="JPEG", quality=92)
-            return out.getvalue(), "image/jpeg"
-    except Exception as e:
-        # If Pillow couldn't open it, try a last-resort: assume JPEG bytes
-        # (This covers rare cases where the file is valid but not recognized)
-        if raw_bytes[:2] == b"\xff\xd8":
-            # Looks like a JPEG magic header; pass through
-            return raw_bytes, "image/jpeg"
-        raise ValueError(f"Could not decode the uploaded image: {e}")
+        return normalize_image(image_file.stream)
+    finally:
+        image_file.stream.seek(0)  # reset for safety if needed elsewhere
 
 
-@app.route('/api/analyze-image', methods=['POST'])
-def analyze_image():
-    # --- DEBUG: do NOT consume the stream here ---
+def spool_request_body(stream, limit=None):
+    """
+    Copy a raw request body into a SpooledTemporaryFile in chunks, so only bodies
+    under UPLOAD_SPOOL_BYTES stay in memory. Raises RequestEntityTooLarge past limit.
+    """
+    limit = MAX_UPLOAD_BYTES if limit is None else limit
+    spool = tempfile.SpooledTemporaryFile(max_size=UPLOAD_SPOOL_BYTES, mode="w+b")
+    total = 0
+    while True:
+        chunk = stream.read(64 * 1024)
+        if not chunk:
+            break
+        total += len(chunk)
+        if limit and total > limit:
+            spool.close()
+            raise RequestEntityTooLarge()
+        spool.write(chunk)
+    spool.seek(0)
+    return spool, total
+
+
+class UploadError(Exception):
+    """A request we can't analyze; carries the JSON error body to send back."""
+
+    def __init__(self, payload, status=400):
+        super().__init__(payload.get('error'))
+        self.payload = payload
+        self.status = status
+
+
+class ModelOutputError(Exception):
+    """
+    The model answered, but not with JSON we can use. salvaged holds the foods that
+    could still be read from it (e.g. before the reply was cut off).
+    """
+
+    def __init__(self, payload, salvaged=None):
+        super().__init__(payload.get('error'))
+        self.payload = payload
+        self.salvaged = salvaged or []
+
+
+def upload_too_large_payload():
+    return {'success': False, 'error': f'Upload is larger than the {MAX_UPLOAD_BYTES} byte limit'}
+
+
+def overloaded_payload(error):
+    return {'success': False, 'error': str(error), 'retry_after': error.retry_after}
+
+
+def overloaded_response(error):
+    """503 (our model queue is full) or 429 (provider quota), with Retry-After."""
+    response = jsonify(overloaded_payload(error))
+    response.status_code = error.status
+    response.headers['Retry-After'] = str(error.retry_after)
+    return response
+
+
+@app.errorhandler(RequestEntityTooLarge)
+def upload_too_large(e):
+    return jsonify(upload_too_large_payload()), 413
+
+
+def upload_finger_length():
+    # Allow optional finger length (inches) from form; default to 3.0
     try:
-        print("=== /api/analyze-image DEBUG ===")
-        print("Content-Type:", request.headers.get("Content-Type"))
-        print("Request method:", request.method)
-        print("Files keys:", list(request.files.keys()))
-        print("Form keys:", list(request.form.keys()))
-        print("Content-Length:", request.content_length)
-        print("================================")
-    except Exception as _dbg_e:
-        print("DEBUG logging failed:", _dbg_e)
-
-    temp_file_path = None
-    converted_temp_path = None
+        return float(request.form.get("finger_length", "3.0"))
+    except Exception:
+        return 3.0
+
+
+def uploaded_image_file():
+    return (
+        request.files.get("image")
+        or request.files.get("file")
+        or request.files.get("photo")
+        or request.files.get("picture")
+    )
 
+
+def no_image_error():
+    return UploadError({
+        "success": False,
+        "error": "No image provided",
+        "debug": {
+            "content_type": request.headers.get("Content-Type"),
+            "files_keys": list(request.files.keys()),
+            "form_keys": list(request.form.keys()),
+        },
+    })
+
+
+def read_upload():
+    """
+    Pull the image out of the current request (multipart field or raw image/* body).
+    Returns (image_bytes, mime_type, finger_length); raises UploadError for bad input.
+    """
+    # Parse the form first so an oversized upload comes back as a 413
     try:
-        # Allow optional finger length (inches) from form; default to 3.0
-        try:
-            finger_length = float(request.form.get("finger_length", "3.0"))
-        except Exception:
-            finger_length = 3.0
-
-        image_part = None
-        image_file = (
-            request.files.get("image")
-            or request.files.get("file")
-            or request.files.get("photo")
-            or request.files.get("picture")
-        )
-
-        if image_file:
-            if getattr(image_file, "filename", "") == "":
-                return jsonify({'success': False, 'error': 'No image selected'}), 400
+        with metrics.timed("request_parse"):
+            request.files
+    except RequestEntityTooLarge:
+        raise UploadError(upload_too_large_payload(), status=413)
 
-            try:
-                image_bytes, mime_type = normalize_image_to_model_supported(image_file)
-            except ValueError as ve:
-                return jsonify({'success': False, 'error': str(ve)}), 400
+    finger_length = upload_finger_length()
+    image_file = uploaded_image_file()
+
+    if image_file:
+        if getattr(image_file, "filename", "") == "":
+            raise UploadError({'success': False, 'error': 'No image selected'})
 
-            if mime_type not in ALLOWED_MODEL_MIMES:
-                # Force JPEG if Pillow produced something else
+        try:
+            image_bytes, mime_type = normalize_image_to_model_supported(image_file)
+        except ValueError as ve:
+            raise UploadError({'success': False, 'error': str(ve)})
+
+    else:
+        # Fallback: raw body with image/* Content-Type
+        ct = request.headers.get("Content-Type", "")
+        if ct.startswith("image/"):
+            try:
+                raw, raw_length = spool_request_body(request.stream)
+            except RequestEntityTooLarge:
+                raise UploadError(upload_too_large_payload(), status=413)
+            with raw:
+                if not raw_length:
+                    raise UploadError({'success': False, 'error': 'Raw image body is empty'})
                 try:
-                    img = Image.open(BytesIO(image_bytes))
-                    if img.mode not in ("RGB", "L"):
-                        img = img.convert("RGB")
-                    out = BytesIO()
-                    img.save(out, format="JPEG", quality=92)
-                    image_bytes = out.getvalue()
-                    mime_type = "image/jpeg"
-                except Exception as e:
-                    return jsonify({'success': False, 'error': f'Could not convert image: {e}'}), 400
+                    image_bytes, mime_type = normalize_image(raw)
+                except ValueError as ve:
+                    raise UploadError({"success": False, "error": str(ve)})
+        else:
+            raise no_image_error()
 
-            image_part = Part.from_data(data=image_bytes, mime_type=mime_type)
+    return image_bytes, mime_type, finger_length
 
-        else:
-            # Fallback: raw body with image/* Content-Type
-            ct = request.headers.get("Content-Type", "")
-            if ct.startswith("image/"):
-                raw = request.get_data(cache=True)  # cache=True so we don't lose it later
-                if not raw:
-                    return jsonify({'success': False, 'error': 'Raw image body is empty'}), 400
-                try:
-                    img = Image.open(BytesIO(raw))
-                    if img.mode not in ("RGB", "L"):
-                        img = img.convert("RGB")
-                    out = BytesIO()
-                    out_format = "PNG" if img.mode == "L" and hasattr(img, "info") and img.info.get("transparency") else "JPEG"
-                    if out_format == "PNG":
-                        img.save(out, format="PNG", optimize=True)
-                        mime_type = "image/png"
-                    else:
-                        img.save(out, format="JPEG", quality=92)
-                        mime_type = "image/jpeg"
-                    image_bytes = out.getvalue()
-                    image_part = Part.from_data(data=image_bytes, mime_type=mime_type)
-                except Exception as e:
-                    return jsonify({"success": False, "error": f"Raw image body could not be decoded: {e}"}), 400
-            else:
-                return jsonify({
-                    "success": False,
-                    "error": "No image provided",
-                    "debug": {
-                        "content_type": request.headers.get("Content-Type"),
-                        "files_keys": list(request.files.keys()),
-                        "form_keys": list(request.form.keys()),
-                    },
-                }), 400
-
-        # --- Prompt & model ---
-        prompt_text = f"""
+
+def read_raw_upload():
+    """
+    Like read_upload, but returns the image as sent, without preprocessing it (a
+    job worker does that later). Returns (raw_bytes, finger_length).
+    """
+    try:
+        request.files
+    except RequestEntityTooLarge:
+        raise UploadError(upload_too_large_payload(), status=413)
+
+    finger_length = upload_finger_length()
+    image_file = uploaded_image_file()
+    if image_file:
+        if getattr(image_file, "filename", "") == "":
+            raise UploadError({'success': False, 'error': 'No image selected'})
+        raw = image_file.stream.read()
+    elif request.headers.get("Content-Type", "").startswith("image/"):
+        try:
+            spool, _ = spool_request_body(request.stream)
+        except RequestEntityTooLarge:
+            raise UploadError(upload_too_large_payload(), status=413)
+        with spool:
+            raw = spool.read()
+    else:
+        raise no_image_error()
+
+    if not raw:
+        raise UploadError({'success': False, 'error': 'Uploaded image is empty'})
+    return raw, finger_length
+
+
+def build_model_contents(image_bytes, mime_type, finger_length):
+    """The generate_content request for one plate photo."""
+    prompt_text = f"""
 I have a plate of food. Please identify the food items and estimate their portion sizes in grams, and also estimate the volume of each item.
 If there is a hand in the picture, assume a middle finger length of {finger_length} inches for scale. Otherwise, use standard plate size or other visible references.
 Return a JSON array where each element has keys: 'food_item', 'estimated_weight_grams', 'volume_food'.
@@ -836,65 +517,422 @@ IMPORTANT:
 - After you identify the food, map its name to the closest item in the attached list, but KEEP your original weight estimate.
 """
 
-        model = GenerativeModel("gemini-2.5-pro")
-        response = model.generate_content([image_part, prompt_text, list_text])
+    warm_up()
+    contents = [model_runner.image_part(image_bytes, mime_type), prompt_text]
+    snapshot = emissions_store.current
+    if snapshot is not None:
+        contents.append(snapshot.vocabulary)
+    return contents
 
-        response_text = (response.text or "").strip()
-        print(f"Raw Gemini response: {response_text}")
 
-        # Strip code fences if present
-        if "```json" in response_text:
-            json_start = response_text.find("```json") + 7
-            json_end = response_text.find("```", json_start)
-            response_text = response_text[json_start:json_end].strip()
-        elif "```" in response_text:
-            json_start = response_text.find("```") + 3
-            json_end = response_text.rfind("```")
-            response_text = response_text[json_start:json_end].strip()
+def parse_model_response(response):
+    """
+    Turn the model's reply into the list of detected foods. Raises ModelOutputError
+    if it isn't a complete, usable JSON array (see model_output.parse_foods).
+    """
+    response_text = (response.text or "").strip()
+    if logs.should_log(logger):
+        logger.debug("Raw model response: %s", response_text)
+
+    try:
+        foods, complete = parse_foods(response_text)
+        reason = 'reply was cut off or has unusable entries'
+    except ValueError as e:
+        foods, complete, reason = [], False, str(e)
+
+    if complete:
+        metrics.increment('model_parse_ok')
+        return foods
 
+    metrics.increment('model_parse_failed')
+    logger.warning("Could not parse model reply: %s", reason)
+    raise ModelOutputError({
+        'success': False,
+        'error': f'Failed to parse AI response as JSON: {reason}',
+        'raw_response': response_text
+    }, salvaged=foods)
+
+
+def recover_model_output(error, repair_response):
+    """
+    Foods after a failed parse, given the reply to the repair request (or None if
+    there was none): the repaired list if it parses, else whatever was salvaged from
+    the original reply. Returns (foods, partial); raises error if there's nothing.
+    """
+    if repair_response is not None:
         try:
-            ai_return_data = json.loads(response_text)
-            if not isinstance(ai_return_data, list):
-                raise ValueError("Response is not a list")
-
-            food_items = [item.get("food_item", "") for item in ai_return_data]
-            weights = [item.get("estimated_weight_grams", 0) for item in ai_return_data]
-
-            print(f"Detected foods: {food_items}")
-            print(f"Weights: {weights}")
-
-            final_carbon, food_details, total_carbon = calculate_carbon_footprint(food_items, weights)
-
-            return jsonify({
-                'success': True,
-                'detected_foods': ai_return_data,
-                'carbon_analysis': {
-                    'food_details': food_details,
-                    'individual_carbon_footprints': final_carbon,
-                    'total_carbon_footprint_kg': round(total_carbon, 4),
-                    'total_carbon_footprint_g': round(total_carbon * 1000, 2)
-                },
-                'summary': f"Total CO2 equivalent: {round(total_carbon, 4)} kg ({round(total_carbon * 1000, 2)} grams)"
-            })
+            foods, complete = parse_foods((repair_response.text or "").strip())
+        except ValueError:
+            complete = False
+        if complete:
+            metrics.increment('model_parse_repaired')
+            return foods, False
+        metrics.increment('model_repair_failed')
+
+    if error.salvaged:
+        metrics.increment('model_parse_salvaged')
+        return error.salvaged, True
+    raise error
+
+
+def repair_model_output(error):
+    """Retry a failed parse with a cheap text-only request; see recover_model_output."""
+    response = None
+    if MODEL_OUTPUT_REPAIR:
+        try:
+            response = model_runner.generate(repair_contents(error.payload.get('raw_response')),
+                                             timeout=MODEL_REPAIR_TIMEOUT, response_schema=FOOD_SCHEMA)
+        except Exception as e:
+            logger.warning("Model output repair request failed: %s", e)
+    return recover_model_output(error, response)
+
+
+def build_analysis_payload(ai_return_data, cache_hit=False, calculator=None, snapshot=None):
+    """Run the carbon calculation over the detected foods and build the response body."""
+    food_items = [item.get("food_item", "") for item in ai_return_data]
+    weights = [item.get("estimated_weight_grams", 0) for item in ai_return_data]
+
+    if logs.should_log(logger):
+        logger.debug("Detected foods: %s, weights: %s", food_items, weights)
+
+    # One snapshot for the whole payload, even if the data reloads meanwhile
+    snapshot = snapshot or current_emissions()
+    calculator = calculator or calculate_carbon_footprint
+    with metrics.timed("carbon_lookup"):
+        final_carbon, food_details, total_carbon = calculator(food_items, weights, snapshot)
+    unmatched = sum(1 for detail in food_details if 'matched_name' not in detail)
+    metrics.increment('foods_matched', len(food_details) - unmatched)
+    metrics.increment('foods_unmatched', unmatched)
+
+    return {
+        'success': True,
+        'detected_foods': ai_return_data,
+        'carbon_analysis': {
+            'food_details': food_details,
+            'individual_carbon_footprints': final_carbon,
+            'total_carbon_footprint_kg': round(total_carbon, 4),
+            'total_carbon_footprint_g': round(total_carbon * 1000, 2)
+        },
+        'cached': cache_hit,
+        'dataset_version': snapshot.version,
+        'summary': f"Total CO2 equivalent: {round(total_carbon, 4)} kg ({round(total_carbon * 1000, 2)} grams)"
+    }
+
+
+def analysis_key(image_bytes, finger_length):
+    """Identifies one analysis for request coalescing: the prepared image and finger length."""
+    return f"{content_hash(image_bytes)}:{finger_length}"
+
+
+def run_analysis(image_bytes, mime_type, finger_length):
+    """
+    Detected foods for one prepared image: from the cache, or from the model.
+    Returns (ai_return_data, cache_hit); raises ModelTimeout, ModelOverloaded or
+    ModelOutputError.
+    """
+    # Re-sent photos skip the model call; only the carbon numbers are recomputed
+    ai_return_data = analysis_cache.get(image_bytes, finger_length)
+    if ai_return_data is not None:
+        return ai_return_data, True
+
+    def analyze():
+        with metrics.timed("upload"):
+            contents = build_model_contents(image_bytes, mime_type, finger_length)
+        # Runs on the model thread pool so a hung call can't pin this worker
+        response = model_runner.generate(contents, response_schema=FOOD_SCHEMA)
+        try:
+            with metrics.timed("parse"):
+                ai_return_data = parse_model_response(response)
+        except ModelOutputError as e:
+            ai_return_data, partial = repair_model_output(e)
+            if partial:
+                # Don't let a cut-off reply stick in the cache
+                return ai_return_data
+        analysis_cache.put(image_bytes, finger_length, ai_return_data)
+        return ai_return_data
+
+    # A duplicate of a photo that's still being analyzed waits for that call
+    ai_return_data, _ = in_flight.do(analysis_key(image_bytes, finger_length), analyze)
+    return ai_return_data, False
+
+
+def requested_stream_format():
+    """
+    'sse' or 'ndjson' if the client asked for a streamed analysis (?stream=sse,
+    ?stream=ndjson, or an Accept header naming one of them), else None.
+    """
+    stream = request.args.get('stream', '').lower()
+    if stream == 'sse':
+        return 'sse'
+    if stream in ('ndjson', '1', 'true'):
+        return 'ndjson'
+    accept = request.headers.get('Accept', '')
+    if 'text/event-stream' in accept:
+        return 'sse'
+    if 'application/x-ndjson' in accept:
+        return 'ndjson'
+    return None
+
+
+def stream_analysis(image_bytes, mime_type, finger_length):
+    """
+    run_analysis for a streamed reply. Yields (event, data): a 'food' event with
+    each detected food and its footprint as soon as the model has finished writing
+    it, then 'result' with the same payload /api/analyze-image returns, or 'error'.
+    If the reply needed repairing, 'result' has the final list of foods.
+    """
+    snapshot = current_emissions()
 
-        except json.JSONDecodeError as e:
-            print(f"JSON decode error: {e}")
-            print(f"Attempted to parse: {response_text}")
-            return jsonify({
-                'success': False,
-                'error': f'Failed to parse AI response as JSON: {str(e)}',
-                'raw_response': response_text
-            }), 500
+    def food_event(index, food):
+        _, food_details, _ = calculate_carbon_footprint(
+            [food.get("food_item", "")], [food.get("estimated_weight_grams", 0)], snapshot)
+        return 'food', {'index': index, 'food': food, 'carbon': food_details[0]}
 
+    try:
+        ai_return_data = analysis_cache.get(image_bytes, finger_length)
+        if ai_return_data is not None:
+            for index, food in enumerate(ai_return_data):
+                yield food_event(index, food)
+            yield 'result', build_analysis_payload(ai_return_data, True, snapshot=snapshot)
+            return
+
+        with metrics.timed("upload"):
+            contents = build_model_contents(image_bytes, mime_type, finger_length)
+        parser = FoodStreamParser()
+        chunks = []
+        streamed = 0
+        for chunk in model_runner.generate_stream(contents, response_schema=FOOD_SCHEMA):
+            chunks.append(chunk)
+            for item in parser.feed(chunk):
+                food = coerce_food(item)
+                if food is not None:
+                    yield food_event(streamed, food)
+                    streamed += 1
+
+        partial = False
+        try:
+            with metrics.timed("parse"):
+                ai_return_data = parse_model_response(TextResponse("".join(chunks)))
+        except ModelOutputError as e:
+            ai_return_data, partial = repair_model_output(e)
+        if not partial:
+            analysis_cache.put(image_bytes, finger_length, ai_return_data)
+        yield 'result', build_analysis_payload(ai_return_data, False, snapshot=snapshot)
+
+    except ModelTimeout as e:
+        yield 'error', {'success': False, 'status': 504, 'error': str(e)}
+    except ModelOverloaded as e:
+        yield 'error', {'status': e.status, **overloaded_payload(e)}
+    except ModelOutputError as e:
+        yield 'error', {'status': 500, **e.payload}
     except Exception as e:
-        print(f"Error in analyze_image: {str(e)}")
+        logger.exception("Error in streamed analyze_image")
+        yield 'error', {'success': False, 'status': 500, 'error': str(e)}
+
+
+def stream_response(events, stream_format):
+    """Send (event, data) pairs as Server-Sent Events or as NDJSON lines."""
+    def generate():
+        for event, data in events:
+            if stream_format == 'sse':
+                yield f"event: {event}\ndata: {json.dumps(data)}\n\n"
+            else:
+                yield json.dumps({'event': event, **data}) + "\n"
+
+    mimetype = 'text/event-stream' if stream_format == 'sse' else 'application/x-ndjson'
+    # X-Accel-Buffering stops nginx from holding the events back
+    return Response(generate(), mimetype=mimetype,
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+def run_job(raw_bytes, finger_length):
+    """One queued analysis: preprocess, model, carbon. Returns the response payload."""
+    try:
+        image_bytes, mime_type = normalize_image(BytesIO(raw_bytes))
+    except ValueError as e:
+        raise JobError({'success': False, 'error': str(e)})
+    try:
+        ai_return_data, cache_hit = run_analysis(image_bytes, mime_type, finger_length)
+    except ModelTimeout as e:
+        raise JobError({'success': False, 'error': str(e)})
+    except ModelOverloaded as e:
+        raise JobError(overloaded_payload(e))
+    except ModelOutputError as e:
+        raise JobError(e.payload)
+    return build_analysis_payload(ai_return_data, cache_hit)
+
+
+# Background analyses for clients that don't want to hold the connection open
+# (see job_queue.py). Worker threads start on first use, or in post_fork under gunicorn.
+job_queue = make_job_queue(run_job)
+
+
+@app.route('/api/jobs', methods=['POST'])
+def submit_job():
+    """
+    Queue an analysis and answer straight away with its job ID. Same form fields
+    as /api/analyze-image, plus an optional callback_url the finished job is POSTed to.
+    """
+    try:
+        raw_bytes, finger_length = read_raw_upload()
+    except UploadError as e:
+        return jsonify(e.payload), e.status
+
+    try:
+        job, deduplicated = job_queue.submit(raw_bytes, finger_length, request.form.get('callback_url') or None)
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    job_queue.start()
+
+    status_url = url_for('job_status', job_id=job['job_id'])
+    response = jsonify({'success': True, **job, 'deduplicated': deduplicated, 'status_url': status_url})
+    response.status_code = 200 if job['status'] == 'done' else 202
+    response.headers['Location'] = status_url
+    return response
+
+
+@app.route('/api/jobs/<job_id>')
+def job_status(job_id):
+    # Make sure jobs left queued by a restart get picked up
+    job_queue.start()
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({'success': False, 'error': 'Unknown job'}), 404
+    return jsonify({'success': True, **job})
+
+
+@app.route('/api/jobs')
+def job_stats():
+    # Queue depth and queue-wait / run / total latency percentiles, across all workers
+    return jsonify(job_queue.stats())
+
+
+@app.route('/api/analyze-image', methods=['POST'])
+def analyze_image():
+    # Headers only: touching request.files here would parse the upload early
+    if logs.should_log(logger):
+        logger.debug("analyze-image: Content-Type=%s Content-Length=%s args=%s",
+                      request.headers.get("Content-Type"), request.content_length, dict(request.args))
+
+    # Async mode: queue it and return a job ID (see submit_job)
+    if request.args.get('mode') == 'async':
+        return submit_job()
+
+    if TRACE_UPLOAD_MEMORY:
+        tracemalloc.reset_peak()
+
+    try:
+        try:
+            image_bytes, mime_type, finger_length = read_upload()
+        except UploadError as e:
+            return jsonify(e.payload), e.status
+        finally:
+            if TRACE_UPLOAD_MEMORY:
+                metrics.record_value("upload_peak_bytes", tracemalloc.get_traced_memory()[1])
+
+        # Streamed: each food's footprint goes out as soon as the model has named it
+        stream_format = requested_stream_format()
+        if stream_format:
+            return stream_response(stream_analysis(image_bytes, mime_type, finger_length), stream_format)
+
+        try:
+            ai_return_data, cache_hit = run_analysis(image_bytes, mime_type, finger_length)
+        except ModelTimeout as e:
+            return jsonify({'success': False, 'error': str(e)}), 504
+        except ModelOverloaded as e:
+            return overloaded_response(e)
+        except ModelOutputError as e:
+            return jsonify(e.payload), 500
+
+        payload = build_analysis_payload(ai_return_data, cache_hit)
+        with metrics.timed("serialize"):
+            return jsonify(payload)
+
+    except Exception as e:
+        logger.exception("Error in analyze_image")
         return jsonify({'success': False, 'error': str(e)}), 500
 
-    finally:
-        if temp_file_path and os.path.exists(temp_file_path):
-            os.unlink(temp_file_path)
-        if converted_temp_path and os.path.exists(converted_temp_path):
-            os.unlink(converted_temp_path)
+@app.route('/api/analyze-batch', methods=['POST'])
+def analyze_batch():
+    """
+    Analyze several plate photos in one request. Every file part in the form is an
+    image; finger_length applies to all of them. Images are preprocessed in parallel
+    (BATCH_PREPROCESS_WORKERS) and sent to the model with at most
+    BATCH_MODEL_CONCURRENCY calls in flight.
+    Results stream back as NDJSON, one line per image in completion order, then a
+    final summary line. A failed image gets an error line; the batch carries on.
+    """
+    try:
+        uploads = [upload for _, upload in request.files.items(multi=True) if upload.filename]
+    except RequestEntityTooLarge:
+        return jsonify(upload_too_large_payload()), 413
+
+    if not uploads:
+        return jsonify({'success': False, 'error': 'No images provided'}), 400
+    if len(uploads) > BATCH_MAX_IMAGES:
+        return jsonify({'success': False, 'error': f'At most {BATCH_MAX_IMAGES} images per batch'}), 400
+
+    try:
+        finger_length = float(request.form.get("finger_length", "3.0"))
+    except Exception:
+        finger_length = 3.0
+
+    def prepare(upload):
+        try:
+            return normalize_image(upload.stream)
+        except Exception as e:
+            return e
+
+    # Preprocess everything up front, in parallel; the uploads are closed with the
+    # request, so they have to be read before the streamed response starts
+    with concurrent.futures.ThreadPoolExecutor(max_workers=min(len(uploads), BATCH_PREPROCESS_WORKERS)) as pool:
+        prepared = list(pool.map(prepare, uploads))
+
+    def error_line(index, error):
+        if isinstance(error, ModelOutputError):
+            payload = error.payload
+        elif isinstance(error, ModelOverloaded):
+            payload = overloaded_payload(error)
+        else:
+            payload = {'success': False, 'error': str(error)}
+        return json.dumps({'index': index, 'filename': uploads[index].filename, **payload}) + "\n"
+
+    def generate():
+        total_carbon = 0.0
+        succeeded = 0
+        with concurrent.futures.ThreadPoolExecutor(max_workers=BATCH_MODEL_CONCURRENCY) as pool:
+            futures = {}
+            for index, result in enumerate(prepared):
+                if isinstance(result, Exception):
+                    yield error_line(index, result)
+                else:
+                    futures[pool.submit(run_analysis, *result, finger_length)] = index
+
+            for future in concurrent.futures.as_completed(futures):
+                index = futures[future]
+                try:
+                    ai_return_data, cache_hit = future.result()
+                    line = build_analysis_payload(ai_return_data, cache_hit, calculate_carbon_footprint_vectorized)
+                except Exception as e:
+                    logger.error("Error in analyze_batch for %s: %s", uploads[index].filename, e)
+                    yield error_line(index, e)
+                    continue
+                total_carbon += sum(line['carbon_analysis']['individual_carbon_footprints'])
+                succeeded += 1
+                yield json.dumps({'index': index, 'filename': uploads[index].filename, **line}) + "\n"
+
+        yield json.dumps({
+            'done': True,
+            'images': len(uploads),
+            'succeeded': succeeded,
+            'failed': len(uploads) - succeeded,
+            'total_carbon_footprint_kg': round(total_carbon, 4),
+        }) + "\n"
+
+    return Response(generate(), mimetype='application/x-ndjson')
+
 
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=5001, debug=True)
\ No newline at end of file
+    # Development server only; production runs under gunicorn (see gunicorn.conf.py)
+    app.run(host='0.0.0.0', port=int(os.environ.get('PORT', '5001')),
+            debug=os.environ.get('FLASK_DEBUG') == '1', threaded=True)
\ No newline at end of file
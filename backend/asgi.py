@@ -0,0 +1,248 @@
+# ASGI entry point: uvicorn asgi:application --host 0.0.0.0 --port 5001
+#
+# POST /api/analyze-image is served natively here: upload decoding runs on a
+# thread, and the Gemini call is awaited through model_runner.generate_async, so
+# an event loop can hold hundreds of multi-second analyses in flight without a
+# thread per request. Every other route is passed through to the Flask app.
+# Streamed analyses (?stream=sse|ndjson) run in the Flask app as well, with each
+# event forwarded to the client as soon as it's produced.
+
+import asyncio
+import json
+import sys
+import tempfile
+
+import logs
+import metrics
+import model_runner
+from model_output import FOOD_SCHEMA, repair_contents
+from app import (
+    MAX_UPLOAD_BYTES,
+    MODEL_OUTPUT_REPAIR,
+    MODEL_REPAIR_TIMEOUT,
+    UPLOAD_SPOOL_BYTES,
+    ModelOutputError,
+    ModelOverloaded,
+    ModelTimeout,
+    UploadError,
+    analysis_cache,
+    analysis_key,
+    app,
+    build_analysis_payload,
+    build_model_contents,
+    in_flight,
+    overloaded_payload,
+    parse_model_response,
+    read_upload,
+    recover_model_output,
+    requested_stream_format,
+    upload_too_large_payload,
+    warm_up,
+)
+
+logger = logs.get_logger("asgi")
+
+
+class BodyTooLarge(Exception):
+    pass
+
+
+def _build_environ(scope, body, length):
+    """A WSGI environ for the request (body is a file) so Flask/Werkzeug can parse it."""
+    server = scope.get("server") or ("localhost", 80)
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": scope.get("root_path", ""),
+        "PATH_INFO": scope["path"],
+        "QUERY_STRING": scope.get("query_string", b"").decode("latin1"),
+        "SERVER_NAME": str(server[0]),
+        "SERVER_PORT": str(server[1]),
+        "SERVER_PROTOCOL": f"HTTP/{scope.get('http_version', '1.1')}",
+        "CONTENT_LENGTH": str(length),
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": body,
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": True,
+        "wsgi.run_once": False,
+    }
+    if scope.get("client"):
+        environ["REMOTE_ADDR"] = scope["client"][0]
+    for name, value in scope.get("headers", []):
+        name = name.decode("latin1").lower()
+        value = value.decode("latin1")
+        if name == "content-type":
+            environ["CONTENT_TYPE"] = value
+        elif name != "content-length":
+            key = "HTTP_" + name.upper().replace("-", "_")
+            environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
+
+
+def _call_wsgi(environ):
+    captured = {}
+
+    def start_response(status, headers, exc_info=None):
+        captured["status"] = status
+        captured["headers"] = headers
+
+    result = app(environ, start_response)
+    try:
+        body = b"".join(result)
+    finally:
+        if hasattr(result, "close"):
+            result.close()
+    return int(captured["status"].split()[0]), captured["headers"], body
+
+
+async def _send_wsgi_streamed(send, environ):
+    """Run the Flask app for a streamed response, sending each chunk as it arrives."""
+    captured = {}
+
+    def start_response(status, headers, exc_info=None):
+        captured["status"] = status
+        captured["headers"] = headers
+
+    result = await asyncio.to_thread(app, environ, start_response)
+    chunks = iter(result)
+    try:
+        await send({
+            "type": "http.response.start",
+            "status": int(captured["status"].split()[0]),
+            "headers": [(k.lower().encode("latin1"), v.encode("latin1")) for k, v in captured["headers"]],
+        })
+        while True:
+            # The next event may wait on the model, so don't block the loop for it
+            chunk = await asyncio.to_thread(next, chunks, None)
+            if chunk is None:
+                break
+            await send({"type": "http.response.body", "body": chunk, "more_body": True})
+        await send({"type": "http.response.body", "body": b""})
+    finally:
+        if hasattr(result, "close"):
+            await asyncio.to_thread(result.close)
+
+
+async def analyze_image_async(environ):
+    """The /api/analyze-image pipeline with the model call awaited. Returns (status, payload)."""
+
+    def prepare():
+        # Blocks (off the event loop) until the app has finished warming up
+        warm_up()
+        with app.request_context(environ):
+            image_bytes, mime_type, finger_length = read_upload()
+        return image_bytes, mime_type, finger_length, analysis_cache.get(image_bytes, finger_length)
+
+    try:
+        try:
+            image_bytes, mime_type, finger_length, ai_return_data = await asyncio.to_thread(prepare)
+        except UploadError as e:
+            return e.status, e.payload
+
+        cache_hit = ai_return_data is not None
+        if not cache_hit:
+            async def analyze():
+                with metrics.timed("upload"):
+                    contents = build_model_contents(image_bytes, mime_type, finger_length)
+                response = await model_runner.generate_async(contents, response_schema=FOOD_SCHEMA)
+
+                partial = False
+                try:
+                    with metrics.timed("parse"):
+                        ai_return_data = parse_model_response(response)
+                except ModelOutputError as e:
+                    repair_response = None
+                    if MODEL_OUTPUT_REPAIR:
+                        try:
+                            repair_response = await model_runner.generate_async(
+                                repair_contents(e.payload.get('raw_response')),
+                                timeout=MODEL_REPAIR_TIMEOUT, response_schema=FOOD_SCHEMA)
+                        except Exception as repair_error:
+                            logger.warning("Model output repair request failed: %s", repair_error)
+                    ai_return_data, partial = recover_model_output(e, repair_response)
+                if not partial:
+                    await asyncio.to_thread(analysis_cache.put, image_bytes, finger_length, ai_return_data)
+                return ai_return_data
+
+            # A duplicate of a photo that's still being analyzed awaits that call
+            try:
+                ai_return_data, _ = await in_flight.do_async(analysis_key(image_bytes, finger_length), analyze)
+            except ModelTimeout as e:
+                return 504, {'success': False, 'error': str(e)}
+            except ModelOverloaded as e:
+                return e.status, overloaded_payload(e)
+            except ModelOutputError as e:
+                return 500, e.payload
+
+        return 200, build_analysis_payload(ai_return_data, cache_hit)
+
+    except Exception as e:
+        logger.exception("Error in analyze_image_async")
+        return 500, {'success': False, 'error': str(e)}
+
+
+async def _read_body(receive):
+    """Spool the request body like the Flask side does; returns (file, length)."""
+    spool = tempfile.SpooledTemporaryFile(max_size=UPLOAD_SPOOL_BYTES, mode="w+b")
+    length = 0
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            spool.close()
+            raise ConnectionError("Client disconnected")
+        chunk = message.get("body", b"")
+        length += len(chunk)
+        if length > MAX_UPLOAD_BYTES:
+            spool.close()
+            raise BodyTooLarge()
+        spool.write(chunk)
+        if not message.get("more_body"):
+            spool.seek(0)
+            return spool, length
+
+
+async def _send(send, status, headers, body):
+    await send({"type": "http.response.start", "status": status, "headers": headers})
+    await send({"type": "http.response.body", "body": body})
+
+
+async def application(scope, receive, send):
+    if scope["type"] == "lifespan":
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+    if scope["type"] != "http":
+        return
+
+    json_headers = [(b"content-type", b"application/json"), (b"access-control-allow-origin", b"*")]
+    try:
+        body, length = await _read_body(receive)
+    except ConnectionError:
+        return
+    except BodyTooLarge:
+        await _send(send, 413, json_headers, json.dumps(upload_too_large_payload()).encode("utf-8"))
+        return
+
+    with body:
+        environ = _build_environ(scope, body, length)
+
+        if scope["method"] == "POST" and scope["path"] == "/api/analyze-image":
+            with app.request_context(environ):
+                stream_format = requested_stream_format()
+            if stream_format:
+                await _send_wsgi_streamed(send, environ)
+                return
+            status, payload = await analyze_image_async(environ)
+            headers = json_headers
+            if 'retry_after' in payload:
+                headers = headers + [(b"retry-after", str(payload['retry_after']).encode("latin1"))]
+            await _send(send, status, headers, json.dumps(payload).encode("utf-8"))
+            return
+
+        status, headers, content = await asyncio.to_thread(_call_wsgi, environ)
+    await _send(send, status, [(k.lower().encode("latin1"), v.encode("latin1")) for k, v in headers], content)
@@ -0,0 +1,58 @@
+# Rows/second for the vectorized batch calculator vs calculate_carbon_footprint,
+# on synthetic meal records drawn from the emissions table (with some misses).
+# Also checks that both give exactly the same numbers.
+#
+# Run from the backend folder (imports app.py, so the app's dependencies are needed):
+#   python benchmarks/bench_batch.py [--rows 1000000] [--per-item-rows 20000]
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, BACKEND_DIR)
+os.chdir(BACKEND_DIR)
+
+import app
+
+
+def synthetic_meals(rows, seed=0):
+    rng = np.random.default_rng(seed)
+    names = list(app.emissions_store.current.carbon_data["Name"])
+    # Lowercased, partial and unknown labels, like real model output
+    names += [name.lower() for name in names[:50]] + ["egg", "chicken", "dragonfruit smoothie", "xyz"]
+    food_items = [names[i] for i in rng.integers(0, len(names), rows)]
+    weights = rng.integers(1, 500, rows).tolist()
+    return food_items, weights
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark calculate_carbon_footprint_batch")
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--per-item-rows", type=int, default=20_000)
+    args = parser.parse_args()
+
+    food_items, weights = synthetic_meals(args.rows)
+    sample = args.per_item_rows
+
+    start = time.perf_counter()
+    final_carbon, _, _ = app.calculate_carbon_footprint(food_items[:sample], weights[:sample])
+    per_item_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    results, diagnostics = app.calculate_carbon_footprint_batch(food_items, weights)
+    batch_time = time.perf_counter() - start
+
+    batch_carbon = results["carbon_footprint_kg"].to_numpy()[:sample]
+    assert batch_carbon.tolist() == [float(value) for value in final_carbon], "batch and per-item results differ"
+
+    print(f"per-item: {sample:9d} rows in {per_item_time:7.3f} s  {sample / per_item_time:12,.0f} rows/s")
+    print(f"batch:    {args.rows:9d} rows in {batch_time:7.3f} s  {args.rows / batch_time:12,.0f} rows/s")
+    print(f"unmatched rows: {diagnostics['unmatched_rows']}  distinct unmatched names: {len(diagnostics['unmatched_names'])}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+# Compare the old full-resolution quality-92 re-encode with image_pipeline.normalize_image
+# on the sample photos: bytes sent to the model and CPU time spent preprocessing.
+# Two already-clean uploads (small JPEG and PNG, no metadata) are generated from 3oz.jpg
+# to show the pass-through path.
+#
+# Run from the backend folder:
+#   python benchmarks/bench_images.py [--repeat 3] [--max-edge 1600] [--target-bytes 400000]
+
+import argparse
+import os
+import sys
+import time
+from io import BytesIO
+
+from PIL import Image
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, BACKEND_DIR)
+
+import image_pipeline
+from image_pipeline import normalize_image
+
+SAMPLES = ["picture.jpeg", "picture2.jpg", "3oz.jpg"]
+
+
+def legacy_normalize(raw_bytes):
+    """What normalize_image_to_model_supported did before image_pipeline existed."""
+    img = Image.open(BytesIO(raw_bytes))
+    out = BytesIO()
+    if img.format == "PNG":
+        img.save(out, format="PNG", optimize=True)
+        return out.getvalue(), "image/png"
+    if img.mode not in ("RGB", "L"):
+        img = img.convert("RGB")
+    img.save(out, format="JPEG", quality=92)
+    return out.getvalue(), "image/jpeg"
+
+
+def clean_samples():
+    img = Image.open(os.path.join(BACKEND_DIR, "3oz.jpg")).convert("RGB")
+    img.thumbnail((800, 800))
+    samples = []
+    for name, fmt in (("clean-800.jpg", "JPEG"), ("clean-800.png", "PNG")):
+        out = BytesIO()
+        img.save(out, format=fmt)
+        samples.append((name, out.getvalue()))
+    return samples
+
+
+def best_cpu_time(fn, raw_bytes, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.process_time()
+        data, _ = fn(raw_bytes)
+        times.append(time.process_time() - start)
+    return len(data), min(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark image preprocessing on the sample photos")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--max-edge", type=int, default=None)
+    parser.add_argument("--target-bytes", type=int, default=None)
+    args = parser.parse_args()
+
+    if args.max_edge is not None:
+        image_pipeline.IMAGE_MAX_EDGE = args.max_edge
+    if args.target_bytes is not None:
+        image_pipeline.IMAGE_TARGET_BYTES = args.target_bytes
+
+    samples = []
+    for name in SAMPLES:
+        with open(os.path.join(BACKEND_DIR, name), "rb") as f:
+            samples.append((name, f.read()))
+    samples.extend(clean_samples())
+
+    print(f"{'image':14s} {'input':>10s} {'legacy':>10s} {'cpu ms':>7s} {'pipeline':>10s} {'cpu ms':>7s}")
+    for name, raw_bytes in samples:
+        legacy_size, legacy_time = best_cpu_time(legacy_normalize, raw_bytes, args.repeat)
+        new_size, new_time = best_cpu_time(normalize_image, raw_bytes, args.repeat)
+        print(f"{name:14s} {len(raw_bytes):10d} {legacy_size:10d} {legacy_time * 1000:7.1f}"
+              f" {new_size:10d} {new_time * 1000:7.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+# Benchmark emissions loading: the old iterrows/.at midpoint loop vs load_emissions
+# vs memory-mapping the compiled cache from emissions_cache.py.
+#
+# The CSV is replicated to a larger temporary file first so the difference shows up.
+# Run from the backend folder:
+#   python benchmarks/bench_loader.py [--rows 100000]
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from emissions import load_emissions
+from emissions_cache import compile_emissions, load_compiled
+
+CSV_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "longerEmissions.csv")
+
+
+def legacy_load(path):
+    """The loader app.py used before load_emissions existed."""
+    carbon_data = pd.read_csv(path)
+    carbon_data = carbon_data.drop('Entity', axis=1)
+    for index, row in carbon_data.iterrows():
+        value = row["CO2e"]
+        if isinstance(value, str) and "-" in value:
+            value_parts = value.split('-')
+            value_low = float(value_parts[0])
+            value_high = float(value_parts[1])
+            if value_high != value_low:
+                value_new = value_high - ((value_high - value_low)/2)
+            else:
+                value_new = value_high
+            carbon_data.at[index, "CO2e"] = value_new
+    return carbon_data
+
+
+def write_scaled_csv(rows, out_path):
+    base = pd.read_csv(CSV_PATH)
+    copies = -(-rows // len(base))
+    scaled = pd.concat([base] * copies, ignore_index=True).head(rows)
+    scaled.to_csv(out_path, index=False)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the legacy CO2e loop with load_emissions")
+    parser.add_argument("--rows", type=int, default=100_000, help="rows in the scaled CSV")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "emissions.csv")
+        write_scaled_csv(args.rows, path)
+
+        start = time.perf_counter()
+        legacy = legacy_load(path)
+        legacy_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        vectorized = load_emissions(path)
+        vectorized_time = time.perf_counter() - start
+
+        compile_emissions(path)
+        start = time.perf_counter()
+        compiled = load_compiled(path)
+        compiled_time = time.perf_counter() - start
+        assert compiled['CO2e'].tolist() == vectorized['CO2e'].tolist()
+
+    # Same midpoints either way (the legacy loop leaves single values as strings)
+    assert [float(v) for v in legacy['CO2e']] == vectorized['CO2e'].tolist()
+
+    print(f"Rows: {args.rows}")
+    print(f"iterrows loop:  {legacy_time:8.3f} s  (CO2e dtype {legacy['CO2e'].dtype})")
+    print(f"load_emissions: {vectorized_time:8.3f} s  (CO2e dtype {vectorized['CO2e'].dtype})")
+    print(f"mmap cache:     {compiled_time:8.3f} s")
+    print(f"Speedup:        {legacy_time / vectorized_time:.0f}x vectorized, {legacy_time / compiled_time:.0f}x cached")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+# Benchmark the prebuilt EmissionsIndex against the old per-item pandas scans,
+# and show where the trigram matcher picks a different row than the old
+# "first name containing the query" fallback.
+#
+# Run from the backend folder:
+#   python benchmarks/bench_lookup.py [--scale 20] [--repeat 200]
+
+import argparse
+import os
+import sys
+import time
+
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from emissions import EmissionsIndex, ResolutionCache
+
+CSV_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "longerEmissions.csv")
+
+# A mix of exact hits, partial hits and misses, like what Gemini sends back
+QUERIES = [
+    "Sausage", "Omelet", "French toast", "beef", "Mushrooms",
+    "egg", "chicken", "rice", "tuna", "chocolate",
+    "pizza slice", "dragonfruit smoothie", "xyz",
+    "Eggs", "Omelette", "Grilled chicken breast", "Bacon strips",
+]
+
+
+def pandas_lookup(carbon_data, item):
+    """The lookup calculate_carbon_footprint used before the index existed."""
+    matching_rows = carbon_data[carbon_data['Name'].str.lower() == item.lower()]
+    if matching_rows.empty:
+        matching_rows = carbon_data[carbon_data['Name'].str.contains(item, case=False, na=False)]
+    return None if matching_rows.empty else matching_rows.index[0]
+
+
+def scaled_table(scale):
+    carbon_data = pd.read_csv(CSV_PATH).drop('Entity', axis=1)
+    if scale <= 1:
+        return carbon_data
+    copies = [carbon_data]
+    for k in range(1, scale):
+        copy = carbon_data.copy()
+        copy['Name'] = copy['Name'] + f" {k}"
+        copies.append(copy)
+    return pd.concat(copies, ignore_index=True)
+
+
+def time_it(fn, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for query in QUERIES:
+            fn(query)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare EmissionsIndex lookups with pandas scans")
+    parser.add_argument("--scale", type=int, default=1, help="replicate the table this many times")
+    parser.add_argument("--repeat", type=int, default=50, help="passes over the query list")
+    args = parser.parse_args()
+
+    carbon_data = scaled_table(args.scale)
+
+    start = time.perf_counter()
+    index = EmissionsIndex.from_frame(carbon_data)
+    build_time = time.perf_counter() - start
+
+    def substring_lookup(query):
+        label = index.exact(query)
+        return index.partial(query) if label is None else label
+
+    # The substring path has to agree with pandas before its timings mean anything
+    for query in QUERIES:
+        expected = pandas_lookup(carbon_data, query)
+        got = substring_lookup(query)
+        assert expected == got, f"{query!r}: pandas={expected} index={got}"
+
+    lookups = args.repeat * len(QUERIES)
+    pandas_time = time_it(lambda q: pandas_lookup(carbon_data, q), args.repeat)
+    substring_time = time_it(substring_lookup, args.repeat)
+    fuzzy_time = time_it(index.match, args.repeat)
+    resolver = ResolutionCache(index)
+    cached_time = time_it(resolver.match, args.repeat)
+
+    print(f"Rows: {len(carbon_data)}  lookups: {lookups}")
+    print(f"Index build:  {build_time * 1000:.1f} ms")
+    print(f"pandas scan:  {pandas_time / lookups * 1e6:10.1f} us/lookup")
+    print(f"Substring index: {substring_time / lookups * 1e6:7.2f} us/lookup")
+    print(f"Trigram match:   {fuzzy_time / lookups * 1e6:7.2f} us/lookup")
+    print(f"Cached match:    {cached_time / lookups * 1e6:7.2f} us/lookup  "
+          f"(hit ratio {resolver.stats()['hit_ratio']:.2f})")
+    print()
+
+    name_of = carbon_data['Name']
+    print(f"{'query':24} {'old substring match':24} {'trigram match (score)'}")
+    for query in QUERIES:
+        old = substring_lookup(query)
+        new = index.match(query)
+        old_name = "-" if old is None else name_of[old]
+        new_name = "-" if new is None else f"{new.name} ({new.score:.2f})"
+        print(f"{query:24} {old_name:24} {new_name}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+# Cold-start guard: how long `import app` takes, measured with python -X importtime.
+#
+# Imports the app in fresh interpreters with CARBONFORK_WARMUP=lazy, so only the
+# module-level import graph is measured, not the warm-up. Fails (exit 1) if the
+# median import takes longer than --max-ms, or if any of the heavy packages that
+# are meant to load in warm_up() got imported at module level.
+# Run from the backend folder:
+#   python benchmarks/bench_startup.py [--runs 5] [--max-ms 1000] [--top 10]
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+BACKEND = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+# Must not be imported by `import app`; they load in app.warm_up()
+HEAVY_MODULES = ["vertexai", "google.cloud.aiplatform", "pandas", "numpy", "PIL", "pillow_heif"]
+
+
+def import_profile():
+    """One cold `import app`. Returns {module: (self_us, cumulative_us)}."""
+    env = dict(os.environ, CARBONFORK_WARMUP="lazy", PYTHONDONTWRITEBYTECODE="1")
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import app"],
+        cwd=BACKEND, env=env, capture_output=True, text=True,
+    )
+    if proc.returncode != 0:
+        raise RuntimeError(f"import app failed:\n{proc.stderr[-2000:]}")
+
+    modules = {}
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        modules[name.strip()] = (int(self_us), int(cumulative_us))
+    return modules
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure and guard the app's import time")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--max-ms", type=float, default=1000.0, help="fail above this median import time")
+    parser.add_argument("--top", type=int, default=10, help="show the N slowest top-level packages")
+    args = parser.parse_args()
+
+    profiles = [import_profile() for _ in range(args.runs)]
+    totals_ms = [profile["app"][1] / 1000 for profile in profiles]
+    median_ms = statistics.median(totals_ms)
+
+    # Cumulative time per top-level package, from the last run
+    packages = {}
+    for name, (_, cumulative_us) in profiles[-1].items():
+        root = name.split(".")[0]
+        if name == root and name != "app":
+            packages[root] = max(packages.get(root, 0), cumulative_us)
+    slowest = sorted(packages.items(), key=lambda item: item[1], reverse=True)[:args.top]
+
+    print(f"import app: median {median_ms:.1f} ms over {args.runs} runs "
+          f"(min {min(totals_ms):.1f}, max {max(totals_ms):.1f})")
+    print("Slowest top-level imports:")
+    for name, cumulative_us in slowest:
+        print(f"  {name:28} {cumulative_us / 1000:8.1f} ms")
+
+    failures = []
+    heavy = [name for name in HEAVY_MODULES if name in profiles[-1]]
+    if heavy:
+        failures.append(f"imported at module level: {', '.join(heavy)}")
+    if median_ms > args.max_ms:
+        failures.append(f"median import time {median_ms:.1f} ms is over the {args.max_ms:.0f} ms limit")
+
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    if failures:
+        sys.exit(1)
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,245 @@
+# Offline benchmark suite for the whole backend pipeline, for comparing commits.
+#
+# Runs with the stub model (MODEL_BACKEND=stub, zero latency, replying with
+# api_response.json) and the analysis cache off, so no network or credentials are
+# needed and every request does the full amount of work:
+#   image.*   normalize_image_to_model_supported on the sample photos
+#   load.*    load_emissions (CSV parse + CO2e midpoints) and the compiled cache
+#   carbon.*  calculate_carbon_footprint by item count and emissions table size
+#   e2e.*     POST /api/analyze-image through the Flask test client
+#
+# Results are written as JSON (median/min/p95 ms per operation). Given a baseline
+# from an earlier run, any case whose median got slower by more than --threshold
+# fails the run (exit 1).
+# Run from the backend folder:
+#   python benchmarks/bench_suite.py --output bench.json
+#   python benchmarks/bench_suite.py --baseline bench.json [--threshold 0.25] [--filter carbon]
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from io import BytesIO
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, BACKEND_DIR)
+os.chdir(BACKEND_DIR)
+
+_tmp = tempfile.TemporaryDirectory()
+os.environ.update(
+    MODEL_BACKEND="stub",
+    STUB_LATENCY="0",
+    STUB_SEED="0",
+    ANALYSIS_CACHE_BACKEND="off",
+    CARBONFORK_WARMUP="eager",
+    EMISSIONS_RELOAD_INTERVAL="0",
+    MODEL_OUTPUT_REPAIR="0",
+    LOG_LEVEL="ERROR",
+    JOB_QUEUE_PATH=os.path.join(_tmp.name, "jobs.sqlite3"),
+)
+
+import numpy as np
+import pandas as pd
+from werkzeug.datastructures import FileStorage
+
+import app
+from emissions import load_emissions
+from emissions_cache import compile_emissions, load_compiled
+from emissions_store import build_snapshot
+
+CSV_PATH = os.path.join(BACKEND_DIR, "..", "longerEmissions.csv")
+SAMPLES = ["picture.jpeg", "picture2.jpg", "3oz.jpg"]
+TABLE_ROWS = [None, 10_000, 100_000]  # None: the real table
+ITEM_COUNTS = [1, 10, 100]
+
+
+def measure(fn, repeat, min_time):
+    """
+    Per-call timings of fn in ms: one warm-up call, then repeat samples, each
+    averaging as many calls as it takes to fill min_time seconds.
+    """
+    fn()
+    start = time.perf_counter()
+    fn()
+    once = max(time.perf_counter() - start, 1e-7)
+    number = max(1, int(min_time / once))
+
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        samples.append((time.perf_counter() - start) / number * 1000)
+    samples.sort()
+    return {
+        "median_ms": round(statistics.median(samples), 4),
+        "min_ms": round(samples[0], 4),
+        "p95_ms": round(samples[min(len(samples) - 1, int(round(0.95 * (len(samples) - 1))))], 4),
+        "repeat": repeat,
+        "number": number,
+    }
+
+
+def scaled_csv(rows, directory):
+    """The emissions CSV repeated to rows rows, with distinct names so the index grows too."""
+    base = pd.read_csv(CSV_PATH)
+    copies = -(-rows // len(base))
+    frames = [base] + [base.assign(Name=base["Name"] + f" {copy}") for copy in range(1, copies)]
+    path = os.path.join(directory, f"emissions-{rows}.csv")
+    pd.concat(frames, ignore_index=True).head(rows).to_csv(path, index=False)
+    return path
+
+
+def image_cases():
+    cases = {}
+    for name in SAMPLES:
+        with open(name, "rb") as f:
+            raw = f.read()
+
+        def normalize(raw=raw, name=name):
+            app.normalize_image_to_model_supported(FileStorage(BytesIO(raw), filename=name))
+
+        cases[f"image.normalize[{name}]"] = normalize
+    return cases
+
+
+def load_cases(directory):
+    cases = {}
+    for rows in TABLE_ROWS:
+        path = scaled_csv(rows, directory) if rows else CSV_PATH
+        label = rows or "real"
+        compiled = os.path.join(directory, f"emissions-{label}.bin")
+        compile_emissions(path, compiled)
+        cases[f"load.load_emissions[rows={label}]"] = lambda path=path: load_emissions(path)
+        cases[f"load.load_compiled[rows={label}]"] = lambda path=path, compiled=compiled: load_compiled(path, compiled)
+    return cases
+
+
+def carbon_cases(directory):
+    cases = {}
+    rng = np.random.default_rng(0)
+    for rows in TABLE_ROWS:
+        path = os.path.join(directory, f"emissions-{rows}.csv") if rows else CSV_PATH
+        snapshot = build_snapshot(path) if rows else app.current_emissions()
+        names = list(snapshot.carbon_data["Name"])
+        # Mostly exact names, plus lowercased and unknown labels like real model output
+        pool = names[:200] + [name.lower() for name in names[:50]] + ["egg", "chicken", "dragonfruit smoothie"]
+        for count in ITEM_COUNTS:
+            items = [pool[i] for i in rng.integers(0, len(pool), count)]
+            weights = rng.integers(1, 500, count).tolist()
+
+            def calculate(items=items, weights=weights, snapshot=snapshot):
+                # A fresh label cache each call, so this measures matching, not the LRU
+                snapshot.resolver.clear()
+                app.calculate_carbon_footprint(items, weights, snapshot)
+
+            cases[f"carbon.calculate[items={count},rows={rows or 'real'}]"] = calculate
+    return cases
+
+
+def e2e_cases():
+    client = app.app.test_client()
+    cases = {}
+    for name in SAMPLES:
+        with open(name, "rb") as f:
+            raw = f.read()
+
+        def analyze(raw=raw, name=name):
+            response = client.post("/api/analyze-image", data={"image": (BytesIO(raw), name)})
+            if response.status_code != 200:
+                raise RuntimeError(f"analyze-image returned {response.status_code}: {response.get_data(as_text=True)}")
+
+        cases[f"e2e.analyze_image[{name}]"] = analyze
+    return cases
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline, threshold, min_delta_ms):
+    """Cases whose median is more than threshold (fraction) and min_delta_ms slower than the baseline."""
+    regressions = []
+    print(f"\n{'case':52s} {'baseline':>10s} {'now':>10s} {'change':>8s}")
+    for name, result in results.items():
+        old = baseline.get(name)
+        if old is None:
+            continue
+        before, after = old["median_ms"], result["median_ms"]
+        change = (after - before) / before if before else 0.0
+        flag = ""
+        if change > threshold and after - before > min_delta_ms:
+            regressions.append(name)
+            flag = "  REGRESSION"
+        print(f"{name:52s} {before:10.3f} {after:10.3f} {change:+8.1%}{flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the backend pipeline with the stub model")
+    parser.add_argument("--output", help="write results JSON here (default: stdout)")
+    parser.add_argument("--baseline", help="results JSON from an earlier run to compare against")
+    parser.add_argument("--threshold", type=float, default=0.25, help="allowed median slowdown, as a fraction")
+    parser.add_argument("--min-delta-ms", type=float, default=0.05, help="ignore slowdowns smaller than this")
+    parser.add_argument("--filter", default="", help="only run cases whose name contains this")
+    parser.add_argument("--repeat", type=int, default=7, help="samples per case")
+    parser.add_argument("--min-time", type=float, default=0.2, help="seconds per sample")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        cases = {}
+        groups = [("image", image_cases), ("load", lambda: load_cases(directory)),
+                  ("carbon", lambda: carbon_cases(directory)), ("e2e", e2e_cases)]
+        for group, build in groups:
+            # Building the carbon cases needs the scaled CSVs the load cases write
+            if args.filter and args.filter not in group and not (group == "load" and "carbon" in args.filter):
+                continue
+            cases.update(build())
+
+        results = {}
+        for name, fn in cases.items():
+            if args.filter and args.filter not in name:
+                continue
+            results[name] = measure(fn, args.repeat, args.min_time)
+            print(f"{name:52s} {results[name]['median_ms']:10.3f} ms", file=sys.stderr)
+
+    report = {
+        "meta": {
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "timestamp": time.time(),
+            "repeat": args.repeat,
+            "min_time": args.min_time,
+        },
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)["results"]
+        regressions = compare(results, baseline, args.threshold, args.min_delta_ms)
+        if regressions:
+            print(f"FAIL: {len(regressions)} case(s) slower than the baseline by more than {args.threshold:.0%}")
+            sys.exit(1)
+        print("OK")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+# Per-request peak Python memory for an analyze-image upload, read as a bytes copy
+# (the old image_file.read() / request.get_data() path) vs handed to Pillow as a
+# spooled file. Uses tracemalloc, so the numbers cover Python-level allocations.
+#
+# Run from the backend folder:
+#   python benchmarks/bench_upload_memory.py [--image picture.jpeg]
+
+import argparse
+import os
+import sys
+import tempfile
+import tracemalloc
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, BACKEND_DIR)
+
+from image_pipeline import normalize_image
+
+
+def peak_bytes(fn):
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    try:
+        fn()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Peak memory of bytes vs spooled upload handling")
+    parser.add_argument("--image", default="picture.jpeg")
+    parser.add_argument("--spool-bytes", type=int, default=1024 * 1024)
+    args = parser.parse_args()
+
+    path = os.path.join(BACKEND_DIR, args.image)
+    with open(path, "rb") as f:
+        payload = f.read()
+
+    def spooled_upload():
+        # Written in chunks, the way the form parser streams it in
+        upload = tempfile.SpooledTemporaryFile(max_size=args.spool_bytes)
+        for start in range(0, len(payload), 64 * 1024):
+            upload.write(payload[start:start + 64 * 1024])
+        upload.seek(0)
+        return upload
+
+    def via_bytes():
+        with spooled_upload() as upload:
+            normalize_image(upload.read())
+
+    def via_file():
+        with spooled_upload() as upload:
+            normalize_image(upload)
+
+    bytes_peak = peak_bytes(via_bytes)
+    file_peak = peak_bytes(via_file)
+    print(f"Upload: {args.image} ({len(payload)} bytes)")
+    print(f"bytes copy:   peak {bytes_peak / 1e6:7.2f} MB")
+    print(f"spooled file: peak {file_peak / 1e6:7.2f} MB")
+
+
+if __name__ == "__main__":
+    main()
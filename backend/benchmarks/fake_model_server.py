@@ -0,0 +1,113 @@
+# Local stand-in for the Gemini API, for load tests and offline runs.
+#
+# Answers every POST with api_response.json after an optional delay: bare when the
+# request carries a response_schema (structured output), otherwise wrapped in a
+# ```json fence, the way Gemini replies in free-text mode. A request with
+# "stream": true gets the reply as NDJSON {"text": ...} chunks spread over the
+# delay instead. With --quota-qps, requests beyond that many in any one second get
+# 429 with Retry-After, like Vertex over quota. Point the backend at it with:
+#   python benchmarks/fake_model_server.py --port 8099 --latency 2.5 [--quota-qps 5]
+#   CARBONFORK_MODEL_URL=http://127.0.0.1:8099/ python app.py
+# (MODEL_BACKEND=stub does the same without a server; see model_backends.py)
+
+import argparse
+import collections
+import json
+import os
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+RESPONSE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "api_response.json")
+
+
+STREAM_CHUNKS = 8
+
+
+def make_handler(reply_text, latency, jitter, quota_qps=0):
+    fenced_text = "```json\n" + reply_text + "\n```"
+    recent = collections.deque()
+    lock = threading.Lock()
+
+    def over_quota():
+        # Sliding one-second window over accepted requests
+        if not quota_qps:
+            return False
+        now = time.monotonic()
+        with lock:
+            while recent and now - recent[0] >= 1.0:
+                recent.popleft()
+            if len(recent) >= quota_qps:
+                return True
+            recent.append(now)
+        return False
+
+    class FakeModelHandler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            request = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+            if over_quota():
+                body = json.dumps({"error": {"code": 429, "status": "RESOURCE_EXHAUSTED"}}).encode("utf-8")
+                self.send_response(429)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.send_header("Retry-After", "1")
+                self.end_headers()
+                self.wfile.write(body)
+                return
+            try:
+                options = json.loads(request)
+            except ValueError:
+                options = {}
+            text = reply_text if options.get("response_schema") is not None else fenced_text
+            delay = max(0.0, latency + random.uniform(-jitter, jitter))
+            if options.get("stream"):
+                self.stream(text, delay)
+                return
+            time.sleep(delay)
+            body = json.dumps({"text": text}).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def stream(self, text, delay):
+            # HTTP/1.0 with no Content-Length: the body ends when the connection closes
+            self.send_response(200)
+            self.send_header("Content-Type", "application/x-ndjson")
+            self.end_headers()
+            size = -(-len(text) // STREAM_CHUNKS)
+            for start in range(0, len(text), size):
+                time.sleep(delay / STREAM_CHUNKS)
+                self.wfile.write(json.dumps({"text": text[start:start + size]}).encode("utf-8") + b"\n")
+                self.wfile.flush()
+
+        def log_message(self, format, *args):
+            pass
+
+    return FakeModelHandler
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fake Gemini server returning canned JSON")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8099)
+    parser.add_argument("--latency", type=float, default=2.0, help="seconds per response")
+    parser.add_argument("--jitter", type=float, default=0.0, help="+/- seconds of random latency")
+    parser.add_argument("--response", default=RESPONSE_PATH, help="JSON file to return")
+    parser.add_argument("--quota-qps", type=int, default=0, help="answer 429 beyond this many requests a second")
+    args = parser.parse_args()
+
+    with open(args.response) as f:
+        reply_text = f.read().strip()
+
+    handler = make_handler(reply_text, args.latency, args.jitter, args.quota_qps)
+    server = ThreadingHTTPServer((args.host, args.port), handler)
+    server.daemon_threads = True
+    print(f"Fake model server on http://{args.host}:{args.port}/ ({args.latency}s latency)")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,169 @@
+# Requests/second for /api/analyze-image under concurrent load, dev server vs gunicorn.
+#
+# Starts benchmarks/fake_model_server.py, then each server with the backend pointed
+# at it (or, with --backend stub, using the in-process stub model; see
+# model_backends.py). The analysis cache is off, so every request reaches the
+# "model". Then it fires
+# concurrent uploads of picture.jpeg (or --image) at it. Needs gunicorn installed.
+# Run from the backend folder:
+#   python benchmarks/load_test.py [--requests 200] [--concurrency 32] [--latency 0.5]
+#
+# With the full-size sample photo, preprocessing dominates on a small box; pass a
+# smaller --image to measure the I/O-bound case.
+#
+# Or load-test a server that's already running:
+#   python benchmarks/load_test.py --url http://127.0.0.1:5001
+
+import argparse
+import concurrent.futures
+import os
+import statistics
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+import uuid
+
+BACKEND = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+IMAGE_PATH = os.path.join(BACKEND, "picture.jpeg")
+
+
+def multipart_body(image_bytes, finger_length="3.0"):
+    boundary = uuid.uuid4().hex
+    body = (
+        f"--{boundary}\r\n"
+        f'Content-Disposition: form-data; name="finger_length"\r\n\r\n{finger_length}\r\n'
+        f"--{boundary}\r\n"
+        f'Content-Disposition: form-data; name="image"; filename="plate.jpg"\r\n'
+        f"Content-Type: image/jpeg\r\n\r\n"
+    ).encode() + image_bytes + f"\r\n--{boundary}--\r\n".encode()
+    return body, f"multipart/form-data; boundary={boundary}"
+
+
+def post(url, body, content_type):
+    req = urllib.request.Request(url, data=body, headers={"Content-Type": content_type})
+    start = time.perf_counter()
+    try:
+        with urllib.request.urlopen(req, timeout=300) as resp:
+            resp.read()
+            status = resp.status
+    except urllib.error.HTTPError as e:
+        status = e.code
+    except OSError:
+        status = None
+    return status, time.perf_counter() - start
+
+
+def run_load(base_url, requests, concurrency, image_path=IMAGE_PATH):
+    with open(image_path, "rb") as f:
+        body, content_type = multipart_body(f.read())
+    url = base_url.rstrip("/") + "/api/analyze-image"
+
+    start = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(lambda _: post(url, body, content_type), range(requests)))
+    elapsed = time.perf_counter() - start
+
+    latencies = sorted(latency for status, latency in results if status == 200)
+    errors = sum(1 for status, _ in results if status != 200)
+    return {
+        "requests": requests,
+        "errors": errors,
+        "seconds": elapsed,
+        "rps": (requests - errors) / elapsed,
+        "p50_ms": statistics.median(latencies) * 1000 if latencies else None,
+        "p95_ms": latencies[int(len(latencies) * 0.95) - 1] * 1000 if latencies else None,
+    }
+
+
+def wait_until_up(base_url, proc, timeout=120):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"server exited with code {proc.returncode}")
+        try:
+            with urllib.request.urlopen(base_url, timeout=1):
+                return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f"{base_url} did not come up")
+
+
+def start(cmd, env, port):
+    proc = subprocess.Popen(cmd, cwd=BACKEND, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    wait_until_up(f"http://127.0.0.1:{port}/", proc)
+    return proc
+
+
+def stop(proc):
+    proc.terminate()
+    try:
+        proc.wait(timeout=30)
+    except subprocess.TimeoutExpired:
+        proc.kill()
+
+
+def print_result(label, result):
+    p50 = f"{result['p50_ms']:8.0f}" if result["p50_ms"] is not None else "       -"
+    p95 = f"{result['p95_ms']:8.0f}" if result["p95_ms"] is not None else "       -"
+    print(f"{label:28} {result['rps']:8.1f} req/s  p50 {p50} ms  p95 {p95} ms  "
+          f"errors {result['errors']}/{result['requests']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load-test /api/analyze-image")
+    parser.add_argument("--url", help="test this running server instead of starting servers")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--latency", type=float, default=0.5, help="fake model latency in seconds")
+    parser.add_argument("--workers", type=int, default=4, help="gunicorn worker processes")
+    parser.add_argument("--threads", type=int, default=16, help="gunicorn threads per worker")
+    parser.add_argument("--image", default=IMAGE_PATH, help="photo to upload")
+    parser.add_argument("--backend", choices=["http", "stub"], default="http",
+                        help="fake model server over HTTP, or the in-process stub")
+    args = parser.parse_args()
+
+    if args.url:
+        print_result(args.url, run_load(args.url, args.requests, args.concurrency, args.image))
+        return
+
+    fake_port, dev_port, prod_port = 8099, 5101, 5102
+    env = dict(os.environ, ANALYSIS_CACHE_BACKEND="off", EMISSIONS_RELOAD_INTERVAL="0")
+    if args.backend == "stub":
+        fake = None
+        env.update(MODEL_BACKEND="stub", STUB_LATENCY=str(args.latency))
+    else:
+        fake = subprocess.Popen(
+            [sys.executable, "benchmarks/fake_model_server.py", "--port", str(fake_port), "--latency", str(args.latency)],
+            cwd=BACKEND, stdout=subprocess.DEVNULL,
+        )
+        env.update(MODEL_BACKEND="http", CARBONFORK_MODEL_URL=f"http://127.0.0.1:{fake_port}/")
+    print(f"{args.requests} requests, concurrency {args.concurrency}, "
+          f"{args.backend} model latency {args.latency}s")
+    try:
+        # What `python app.py` used to run: Werkzeug with the debugger and reloader
+        dev = start([sys.executable, "app.py"], dict(env, PORT=str(dev_port), FLASK_DEBUG="1"), dev_port)
+        try:
+            print_result("dev server (debug)", run_load(f"http://127.0.0.1:{dev_port}", args.requests,
+                                                        args.concurrency, args.image))
+        finally:
+            stop(dev)
+
+        prod_env = dict(env, PORT=str(prod_port), GUNICORN_WORKERS=str(args.workers),
+                        GUNICORN_THREADS=str(args.threads))
+        prod = start([sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "--access-logfile", "/dev/null"],
+                     prod_env, prod_port)
+        try:
+            label = f"gunicorn {args.workers}x{args.threads}"
+            print_result(label, run_load(f"http://127.0.0.1:{prod_port}", args.requests, args.concurrency,
+                                         args.image))
+        finally:
+            stop(prod)
+    finally:
+        if fake is not None:
+            stop(fake)
+
+
+if __name__ == "__main__":
+    main()
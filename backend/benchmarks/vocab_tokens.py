@@ -0,0 +1,75 @@
+# Report how many input tokens the food vocabulary costs on every generate_content call.
+#
+# Run from the backend folder:
+#   python benchmarks/vocab_tokens.py [--legacy old_app.py] [--remote]
+#
+# --legacy takes a source file that still has the hard-coded list_text blob
+# (e.g. `git show <old-commit>:backend/app.py > old_app.py`) and reports the saving.
+# Tokens are counted with the local Gemini tokenizer when it is available,
+# with --remote through the Vertex count_tokens API, and otherwise estimated.
+
+import argparse
+import ast
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from emissions import build_vocabulary
+from emissions_cache import load_emissions_cached
+
+CSV_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "longerEmissions.csv")
+
+
+def read_legacy_list_text(path):
+    with open(path, encoding="utf-8") as f:
+        tree = ast.parse(f.read())
+    for node in tree.body:
+        if isinstance(node, ast.Assign) and any(getattr(t, "id", None) == "list_text" for t in node.targets):
+            return ast.literal_eval(node.value)
+    raise ValueError(f"No list_text assignment found in {path}")
+
+
+def make_counter(remote):
+    if remote:
+        import vertexai
+        from vertexai.generative_models import GenerativeModel
+
+        vertexai.init(project="carbonfork", location="us-central1")
+        model = GenerativeModel("gemini-2.5-pro")
+        return "vertex count_tokens", lambda text: model.count_tokens(text).total_tokens
+
+    try:
+        from vertexai.preview.tokenization import get_tokenizer_for_model
+
+        tokenizer = get_tokenizer_for_model("gemini-1.5-pro")
+        return "local tokenizer", lambda text: tokenizer.count_tokens(text).total_tokens
+    except Exception:
+        # Roughly four characters per token for short English words
+        return "estimate, ~4 chars/token", lambda text: -(-len(text) // 4)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Count input tokens spent on the food vocabulary")
+    parser.add_argument("--legacy", help="source file containing the old list_text literal")
+    parser.add_argument("--remote", action="store_true", help="count with the Vertex API")
+    args = parser.parse_args()
+
+    method, count = make_counter(args.remote)
+    vocabulary = build_vocabulary(load_emissions_cached(CSV_PATH)["Name"])
+    vocab_tokens = count(vocabulary)
+
+    print(f"Token counts ({method})")
+    print(f"Derived vocabulary: {len(vocabulary.splitlines()):4d} names  {vocab_tokens:6d} tokens")
+
+    if args.legacy:
+        legacy = read_legacy_list_text(args.legacy)
+        legacy_names = [line for line in legacy.splitlines() if line.strip()]
+        legacy_tokens = count(legacy)
+        print(f"Legacy list_text:   {len(legacy_names):4d} names  {legacy_tokens:6d} tokens"
+              f"  ({len(legacy_names) - len(set(legacy_names))} duplicates)")
+        print(f"Saved per request:             {legacy_tokens - vocab_tokens:6d} tokens")
+
+
+if __name__ == "__main__":
+    main()
@@ -2,29 +2,10 @@ import numpy as np
 import pandas as pd
 import json
 
-carbonData = pd.read_csv('../longerEmissions.csv')
+from emissions import load_emissions
 
-#Drop the entity column because we dont need it
-carbonData = carbonData.drop('Entity', axis=1)
-
-print(carbonData.head())
-
-#We want to find the middle point between the two C02e values, so we must do that here
-for index, row in carbonData.iterrows():
-    value = row["CO2e"]
-    if "-" in value:
-        value_parts = value.split('-')
-
-        value_low = float(value_parts[0])
-        #print(value_low)
-
-        value_high = float(value_parts[1])
-        #print(f"The high value is: {value_high}")
-        if value_high != value_low:
-            value_new = value_high - ((value_high - value_low)/2)
-        else:
-            value_new = value_high
-        carbonData.at[index, "CO2e"] = value_new
+#Load the dataset; CO2e ranges like "10.7-109" become their middle point as floats
+carbonData = load_emissions('../longerEmissions.csv')
 
 print(carbonData.head())
 
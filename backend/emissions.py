@@ -0,0 +1,385 @@
+# Shared helpers for the carbon emissions table used by the Flask app and the CLI scripts.
+#
+# The table is small enough to keep in memory, so instead of scanning the pandas
+# Name column for every detected food we build lookup structures once at load time.
+
+import re
+import threading
+from collections import OrderedDict, defaultdict, namedtuple
+
+import numpy as np
+import pandas as pd
+
+import logs
+
+logger = logs.get_logger("emissions")
+
+# "low-high" ranges or a single value, e.g. "10.7-109" or "3.5"
+_NUMBER = r"(\d+(?:\.\d*)?|\.\d+)"
+CO2E_PATTERN = rf"^\s*{_NUMBER}\s*(?:-\s*{_NUMBER})?\s*$"
+WORD_PATTERN = re.compile(r"\w+")
+
+
+def parse_co2e(values):
+    """
+    Turn a column of CO2e strings into float64 midpoints in one vectorized pass.
+    Returns (midpoints, malformed) where malformed is a boolean mask of rows that
+    could not be parsed; those rows come back as NaN.
+    """
+    if pd.api.types.is_numeric_dtype(values):
+        midpoints = values.astype("float64")
+        return midpoints, midpoints.isna()
+
+    parts = values.astype("string").str.extract(CO2E_PATTERN)
+    low = pd.to_numeric(parts[0], errors="coerce").astype("float64")
+    high = pd.to_numeric(parts[1], errors="coerce").astype("float64")
+
+    # Same formula as the old per-row loop so the factors don't move
+    midpoints = low.where(high.isna(), high - ((high - low) / 2)).rename(values.name)
+    return midpoints, midpoints.isna()
+
+
+def load_emissions(path):
+    """
+    Read the emissions CSV into a (Name, CO2e) DataFrame with a float64 CO2e column.
+    Malformed rows are dropped and reported instead of failing the whole load;
+    they are kept in frame.attrs["malformed_rows"] as (csv_line, name, value).
+    """
+    carbon_data = pd.read_csv(path)
+    # Drop the entity column because we don't need it
+    carbon_data = carbon_data.drop('Entity', axis=1, errors='ignore')
+
+    midpoints, malformed = parse_co2e(carbon_data['CO2e'])
+
+    bad_rows = carbon_data[malformed]
+    # +2 for the header line and 1-based line numbers
+    malformed_rows = [(int(i) + 2, name, value) for i, name, value in
+                      zip(bad_rows.index, bad_rows['Name'], bad_rows['CO2e'])]
+    if malformed_rows:
+        logger.warning("Skipping %d malformed CO2e rows in %s: %s", len(malformed_rows), path,
+                       ", ".join(f"line {line}: {name!r} -> {value!r}" for line, name, value in malformed_rows[:10]))
+
+    carbon_data = carbon_data.assign(CO2e=midpoints)[~malformed]
+    carbon_data.attrs["malformed_rows"] = malformed_rows
+    return carbon_data
+
+
+def build_vocabulary(names):
+    """
+    The food name list we attach to the Gemini prompt, derived from the table:
+    one name per line, in table order, duplicates and blanks removed.
+    """
+    seen = set()
+    vocabulary = []
+    for name in names:
+        if not isinstance(name, str):
+            continue
+        name = name.strip()
+        if name and name not in seen:
+            seen.add(name)
+            vocabulary.append(name)
+    return "\n".join(vocabulary)
+
+
+def name_trigrams(text):
+    """
+    Character trigrams of a food name, pg_trgm style: lowercased, split into words
+    and each word padded with two spaces in front and one behind, so "Egg" gives
+    {"  e", " eg", "egg", "gg "}. Punctuation and extra whitespace are ignored.
+    """
+    grams = set()
+    for word in WORD_PATTERN.findall(text.lower()):
+        padded = f"  {word} "
+        for start in range(len(padded) - 2):
+            grams.add(padded[start:start + 3])
+    return grams
+
+
+def normalize_name(text):
+    """Lowercase and collapse punctuation/whitespace: "French-Toast " -> "french toast"."""
+    return " ".join(WORD_PATTERN.findall(text.lower()))
+
+
+Match = namedtuple("Match", ["label", "name", "score"])
+
+
+class EmissionsIndex:
+    """
+    In-memory name index over the emissions table.
+
+    Exact lookups go through a hash map of lowercased names. Everything else goes
+    through a trigram inverted index: candidates are the rows sharing at least one
+    trigram with the query, scored by the Dice coefficient of the two trigram sets
+    (2 * shared / (query grams + name grams)), so "Eggs" ranks "Egg" above
+    "Eggplant". A fuzzy match is only accepted at or above the threshold.
+
+    partial() keeps the old "first name containing the query" behaviour for
+    comparison; it walks a prefix index over every suffix of every name (keys up
+    to GRAM characters long) instead of scanning the table.
+    """
+
+    GRAM = 3
+    # Dice score a fuzzy match needs to be used; "Eggs" -> "Egg" scores 0.67,
+    # "Pancakes" -> "Pancetta" 0.44
+    THRESHOLD = 0.5
+
+    def __init__(self, names, labels=None, threshold=None):
+        self.labels = list(labels) if labels is not None else list(range(len(names)))
+        self.threshold = self.THRESHOLD if threshold is None else threshold
+        self._names = []
+        self._display = []
+        self._exact = {}
+        self._grams = defaultdict(list)
+        self._trigram_counts = []
+        self._postings = defaultdict(list)
+
+        for pos, name in enumerate(names):
+            if not isinstance(name, str):
+                # Missing names never match, like na=False in str.contains
+                self._names.append(None)
+                self._display.append(None)
+                self._trigram_counts.append(0)
+                continue
+            key = name.lower()
+            self._names.append(key)
+            self._display.append(name)
+            self._exact.setdefault(key, pos)
+            self._exact.setdefault(normalize_name(name), pos)
+
+            trigrams = name_trigrams(name)
+            self._trigram_counts.append(len(trigrams))
+            for gram in trigrams:
+                self._postings[gram].append(pos)
+
+            seen = set()
+            for start in range(len(key)):
+                for size in range(1, self.GRAM + 1):
+                    gram = key[start:start + size]
+                    if len(gram) == size and gram not in seen:
+                        seen.add(gram)
+                        self._grams[gram].append(pos)
+
+    @classmethod
+    def from_frame(cls, frame, column="Name", threshold=None):
+        """Build an index from a DataFrame, keeping its row labels."""
+        return cls(frame[column].tolist(), frame.index.tolist(), threshold=threshold)
+
+    def __len__(self):
+        return len(self._names)
+
+    def _exact_pos(self, item):
+        pos = self._exact.get(item.lower())
+        if pos is None:
+            pos = self._exact.get(normalize_name(item))
+        return pos
+
+    def exact(self, item):
+        """Return the row label whose name equals item (case-insensitive), or None."""
+        pos = self._exact_pos(item)
+        return None if pos is None else self.labels[pos]
+
+    def partial(self, item):
+        """Return the first row label whose name contains item (case-insensitive), or None."""
+        query = item.lower()
+        if not query:
+            # An empty string is contained in every name
+            pos = next((p for p, name in enumerate(self._names) if name is not None), None)
+            return None if pos is None else self.labels[pos]
+
+        if len(query) <= self.GRAM:
+            candidates = self._grams.get(query, [])
+        else:
+            # Every candidate must contain all of the query's grams, so walk the shortest list
+            candidates = min(
+                (self._grams.get(query[i:i + self.GRAM], []) for i in range(len(query) - self.GRAM + 1)),
+                key=len,
+            )
+
+        for pos in candidates:
+            if query in self._names[pos]:
+                return self.labels[pos]
+        return None
+
+    def candidates(self, item, limit=5, min_score=0.0):
+        """
+        Rank rows by trigram similarity to item. Returns up to limit Match tuples,
+        best first; ties keep table order.
+        """
+        query = name_trigrams(item)
+        if not query:
+            return []
+
+        shared = defaultdict(int)
+        for gram in query:
+            for pos in self._postings.get(gram, ()):
+                shared[pos] += 1
+
+        size = len(query)
+        scored = []
+        for pos, count in shared.items():
+            score = 2.0 * count / (size + self._trigram_counts[pos])
+            if score >= min_score:
+                scored.append((-score, pos))
+        scored.sort()
+        return [Match(self.labels[pos], self._display[pos], -score) for score, pos in scored[:limit]]
+
+    def match(self, item, threshold=None):
+        """
+        Best row for item: an exact (case/punctuation-insensitive) match scores 1.0,
+        otherwise the top fuzzy candidate if it reaches the threshold. Returns a
+        Match or None.
+        """
+        pos = self._exact_pos(item)
+        if pos is not None:
+            return Match(self.labels[pos], self._display[pos], 1.0)
+
+        threshold = self.threshold if threshold is None else threshold
+        best = self.candidates(item, limit=1, min_score=threshold)
+        return best[0] if best else None
+
+    def lookup(self, item):
+        """Exact match first, then fuzzy match. Returns a row label or None."""
+        match = self.match(item)
+        return None if match is None else match.label
+
+
+class ResolutionCache:
+    """
+    Bounded LRU memo of raw model label -> index.match() result, misses included.
+
+    The model keeps sending back the same few hundred labels, so most lookups never
+    reach the trigram matcher. The cache belongs to one index: build a new one (or
+    call clear()) whenever the emissions data is reloaded.
+    """
+
+    _MISS = object()
+
+    def __init__(self, index, max_entries=4096):
+        self.index = index
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def match(self, item):
+        """Same as index.match(item), served from the cache when possible."""
+        with self._lock:
+            cached = self._entries.get(item)
+            if cached is not None:
+                self._entries.move_to_end(item)
+                self.hits += 1
+                return None if cached is self._MISS else cached
+            self.misses += 1
+
+        match = self.index.match(item)
+        with self._lock:
+            self._entries[item] = self._MISS if match is None else match
+            self._entries.move_to_end(item)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return match
+
+    def lookup(self, item):
+        """Cached index.lookup(item): a row label or None."""
+        match = self.match(item)
+        return None if match is None else match.label
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+
+def calculate_footprints(carbon_data, index, food_items, weights=None):
+    """
+    Vectorized carbon footprints for many (food, grams) pairs at once.
+
+    food_items is a sequence of names, or a DataFrame with 'food_item' and
+    'estimated_weight_grams' (or 'weight_grams') columns, in which case weights is
+    taken from it. index is an EmissionsIndex or a ResolutionCache wrapping one.
+    Each distinct name is resolved once through it, then the factors are gathered
+    and multiplied with NumPy; the numbers are the same as calculating item by item.
+
+    Returns (results, diagnostics): results is a DataFrame with food_item,
+    weight_grams, weight_kg, carbon_per_kg, carbon_footprint_kg, matched,
+    matched_name and match_score columns; diagnostics counts unmatched names and
+    bad rows.
+    """
+    if isinstance(food_items, pd.DataFrame):
+        frame = food_items
+        weight_column = "estimated_weight_grams" if "estimated_weight_grams" in frame else "weight_grams"
+        food_items = frame["food_item"]
+        weights = frame[weight_column]
+
+    names = pd.Series(food_items, dtype=object).reset_index(drop=True)
+    weight_grams = pd.to_numeric(pd.Series(weights).reset_index(drop=True), errors="coerce").to_numpy(dtype="float64")
+    if len(weight_grams) != len(names):
+        raise ValueError("food_items and weights must be the same length")
+
+    # One index lookup per distinct name (missing names get code -1)...
+    codes, uniques = pd.factorize(names)
+    unique_positions = np.full(len(uniques), -1, dtype="int64")
+    unique_scores = np.zeros(len(uniques))
+    unique_is_name = np.zeros(len(uniques), dtype=bool)
+    for i, name in enumerate(uniques):
+        if isinstance(name, str):
+            unique_is_name[i] = True
+            match = index.match(name)
+            if match is not None:
+                unique_positions[i] = carbon_data.index.get_loc(match.label)
+                unique_scores[i] = match.score
+
+    # ...then a gather for every row
+    positions = np.full(len(names), -1, dtype="int64")
+    has_code = codes >= 0
+    positions[has_code] = unique_positions[codes[has_code]]
+    match_score = np.zeros(len(names))
+    match_score[has_code] = unique_scores[codes[has_code]]
+    is_name = np.zeros(len(names), dtype=bool)
+    is_name[has_code] = unique_is_name[codes[has_code]]
+    matched = positions >= 0
+    matched_positions = positions[matched]
+
+    carbon_per_kg = np.zeros(len(names))
+    carbon_per_kg[matched] = carbon_data["CO2e"].to_numpy(dtype="float64")[matched_positions]
+    weight_kg = weight_grams / 1000.0
+    carbon_footprint_kg = np.zeros(len(names))
+    carbon_footprint_kg[matched] = weight_kg[matched] * carbon_per_kg[matched]
+    matched_name = np.full(len(names), None, dtype=object)
+    matched_name[matched] = carbon_data["Name"].to_numpy(dtype=object)[matched_positions]
+
+    results = pd.DataFrame({
+        "food_item": names,
+        "weight_grams": weight_grams,
+        "weight_kg": weight_kg,
+        "carbon_per_kg": carbon_per_kg,
+        "carbon_footprint_kg": carbon_footprint_kg,
+        "matched": matched,
+        "matched_name": matched_name,
+        "match_score": match_score,
+    })
+
+    diagnostics = {
+        "rows": len(names),
+        "matched_rows": int(matched.sum()),
+        "unmatched_rows": int((~matched).sum()),
+        "unmatched_names": names[~matched & is_name].value_counts().to_dict(),
+        "invalid_names": int((~is_name).sum()),
+        "invalid_weights": int(np.isnan(weight_grams).sum()),
+    }
+    return results, diagnostics
@@ -0,0 +1,185 @@
+# Compiled binary cache of the emissions table.
+#
+# Parsing longerEmissions.csv with pandas in every worker is wasted work, so this
+# compiles it once into a flat file that workers memory-map. The factor array is
+# read straight out of the mapping, so its pages are shared between processes.
+#
+# Build it ahead of time with:
+#   python emissions_cache.py ../longerEmissions.csv
+# Workers also rebuild it on demand if it is missing or stale.
+#
+# File layout (little endian, sections 8-byte aligned):
+#   magic            8 bytes  b"CFEMIS01"
+#   header length    uint64
+#   header           JSON: source size/mtime/sha256, row count, section offsets
+#   factors          float64[rows]
+#   name offsets     uint32[rows + 1]
+#   names            utf-8 blob
+
+import hashlib
+import json
+import mmap
+import os
+import struct
+import sys
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+import logs
+from emissions import load_emissions
+
+logger = logs.get_logger("emissions")
+
+MAGIC = b"CFEMIS01"
+CACHE_SUFFIX = ".emissions.bin"
+
+
+def default_cache_path(csv_path):
+    root, _ = os.path.splitext(csv_path)
+    return root + CACHE_SUFFIX
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _align(n):
+    return (n + 7) & ~7
+
+
+def compile_emissions(csv_path, cache_path=None):
+    """Parse the CSV and write the binary cache next to it. Returns the cache path."""
+    cache_path = cache_path or default_cache_path(csv_path)
+    stat = os.stat(csv_path)
+    carbon_data = load_emissions(csv_path)
+
+    factors = carbon_data["CO2e"].to_numpy(dtype="<f8")
+    encoded = [str(name).encode("utf-8") for name in carbon_data["Name"]]
+    offsets = np.zeros(len(encoded) + 1, dtype="<u4")
+    np.cumsum([len(name) for name in encoded], out=offsets[1:])
+    names_blob = b"".join(encoded)
+
+    header = {
+        "source_size": stat.st_size,
+        "source_mtime_ns": stat.st_mtime_ns,
+        "source_sha256": file_sha256(csv_path),
+        "rows": len(factors),
+        "malformed_rows": carbon_data.attrs.get("malformed_rows", []),
+    }
+    # Offsets depend on the header length, so size the header with placeholders first
+    for key in ("factors_offset", "offsets_offset", "names_offset"):
+        header[key] = 0
+    header_bytes = json.dumps(header).encode("utf-8")
+    body_start = _align(len(MAGIC) + 8 + len(header_bytes) + 64)
+    header["factors_offset"] = body_start
+    header["offsets_offset"] = _align(body_start + factors.nbytes)
+    header["names_offset"] = header["offsets_offset"] + offsets.nbytes
+    header_bytes = json.dumps(header).encode("utf-8").ljust(body_start - len(MAGIC) - 8)
+
+    # Write to a temp file and rename so other workers never see a half-written cache
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(cache_path)), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(MAGIC)
+            f.write(struct.pack("<Q", len(header_bytes)))
+            f.write(header_bytes)
+            f.write(factors.tobytes())
+            f.write(b"\0" * (header["offsets_offset"] - body_start - factors.nbytes))
+            f.write(offsets.tobytes())
+            f.write(names_blob)
+        os.replace(tmp_path, cache_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+    return cache_path
+
+
+def _read_header(mapped):
+    if mapped[:len(MAGIC)] != MAGIC:
+        raise ValueError("Not an emissions cache file")
+    (header_len,) = struct.unpack_from("<Q", mapped, len(MAGIC))
+    start = len(MAGIC) + 8
+    return json.loads(bytes(mapped[start:start + header_len]).decode("utf-8"))
+
+
+def is_fresh(header, csv_path):
+    """
+    True if the cache was built from the current CSV. A matching size and mtime is
+    trusted as-is; otherwise the content hash decides, so a touched but unchanged
+    file doesn't force a rebuild and an edited one is never served stale.
+    """
+    stat = os.stat(csv_path)
+    if stat.st_size != header["source_size"]:
+        return False
+    if stat.st_mtime_ns == header["source_mtime_ns"]:
+        return True
+    return file_sha256(csv_path) == header["source_sha256"]
+
+
+def load_compiled(csv_path, cache_path=None):
+    """
+    Memory-map the cache and return it as a (Name, CO2e) DataFrame, or None if the
+    cache is missing or stale. The CO2e column is a read-only view of the mapping.
+    """
+    cache_path = cache_path or default_cache_path(csv_path)
+    if not os.path.exists(cache_path):
+        return None
+
+    with open(cache_path, "rb") as f:
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    try:
+        header = _read_header(mapped)
+        if not is_fresh(header, csv_path):
+            mapped.close()
+            return None
+    except (ValueError, KeyError):
+        mapped.close()
+        return None
+
+    rows = header["rows"]
+    factors = np.frombuffer(mapped, dtype="<f8", count=rows, offset=header["factors_offset"])
+    offsets = np.frombuffer(mapped, dtype="<u4", count=rows + 1, offset=header["offsets_offset"])
+    names_start = header["names_offset"]
+    blob = bytes(mapped[names_start:names_start + int(offsets[-1])])
+    names = [blob[offsets[i]:offsets[i + 1]].decode("utf-8") for i in range(rows)]
+
+    carbon_data = pd.DataFrame({"Name": names, "CO2e": factors}, copy=False)
+    carbon_data.attrs["malformed_rows"] = [tuple(row) for row in header["malformed_rows"]]
+    return carbon_data
+
+
+def load_emissions_cached(csv_path, cache_path=None):
+    """
+    Load the emissions table from the compiled cache, (re)building it first if it
+    is missing or stale. Falls back to parsing the CSV if the cache can't be written.
+    """
+    carbon_data = load_compiled(csv_path, cache_path)
+    if carbon_data is not None:
+        return carbon_data
+
+    try:
+        compile_emissions(csv_path, cache_path)
+    except OSError as e:
+        logger.warning("Could not write emissions cache (%s); parsing CSV directly", e)
+        return load_emissions(csv_path)
+
+    carbon_data = load_compiled(csv_path, cache_path)
+    if carbon_data is None:
+        # The CSV changed while we were compiling; just use the CSV this time
+        return load_emissions(csv_path)
+    return carbon_data
+
+
+if __name__ == "__main__":
+    csv_path = sys.argv[1] if len(sys.argv) > 1 else "../longerEmissions.csv"
+    cache_path = sys.argv[2] if len(sys.argv) > 2 else None
+    out = compile_emissions(csv_path, cache_path)
+    print(f"Compiled {csv_path} -> {out} ({os.path.getsize(out)} bytes)")
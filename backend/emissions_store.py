@@ -0,0 +1,152 @@
+# Hot-reloadable emissions dataset.
+#
+# Everything a request needs from the emissions table (the DataFrame, the name
+# index, the label cache and the prompt vocabulary) lives in one immutable
+# snapshot. A background thread polls the CSV and its compiled cache, builds a new
+# snapshot off the request path when they change, and swaps it in with a single
+# assignment. A request grabs the current snapshot once and uses it throughout,
+# so it never mixes factors from two versions, and in-flight model calls keep
+# running across a reload.
+
+import os
+import threading
+import time
+from collections import namedtuple
+
+import logs
+from emissions import EmissionsIndex, ResolutionCache, build_vocabulary
+from emissions_cache import default_cache_path, file_sha256, load_emissions_cached
+
+logger = logs.get_logger("emissions")
+
+EmissionsSnapshot = namedtuple(
+    "EmissionsSnapshot",
+    ["version", "carbon_data", "index", "resolver", "vocabulary", "loaded_at"],
+)
+
+
+def dataset_version(csv_path):
+    """Short content hash of the CSV, reported to clients as dataset_version."""
+    return file_sha256(csv_path)[:12]
+
+
+def build_snapshot(csv_path, threshold=None, cache_size=4096, vocabulary_factory=None):
+    """
+    Load the table and build every derived structure for it. vocabulary_factory
+    turns the vocabulary text into whatever the model call wants (e.g. a Part).
+    """
+    version = dataset_version(csv_path)
+    carbon_data = load_emissions_cached(csv_path)
+    index = EmissionsIndex.from_frame(carbon_data, threshold=threshold)
+    vocabulary = build_vocabulary(carbon_data["Name"])
+    if vocabulary_factory is not None:
+        vocabulary = vocabulary_factory(vocabulary)
+    return EmissionsSnapshot(
+        version=version,
+        carbon_data=carbon_data,
+        index=index,
+        resolver=ResolutionCache(index, max_entries=cache_size),
+        vocabulary=vocabulary,
+        loaded_at=time.time(),
+    )
+
+
+class EmissionsStore:
+    """Holds the current EmissionsSnapshot and reloads it when the source files change."""
+
+    def __init__(self, csv_path, threshold=None, cache_size=4096, vocabulary_factory=None):
+        self.csv_path = csv_path
+        self.threshold = threshold
+        self.cache_size = cache_size
+        self.vocabulary_factory = vocabulary_factory
+        self.current = None
+        self.reloads = 0
+        self.last_error = None
+        self._stamp = None
+        self._reload_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._watcher = None
+        self._watcher_pid = None
+
+    def _file_stamp(self):
+        # The compiled cache is watched too, so a rebuilt artifact is picked up
+        stamp = []
+        for path in (self.csv_path, default_cache_path(self.csv_path)):
+            try:
+                stat = os.stat(path)
+                stamp.append((stat.st_size, stat.st_mtime_ns))
+            except OSError:
+                stamp.append(None)
+        return tuple(stamp)
+
+    def load(self):
+        """Build a snapshot from the files as they are now and make it current."""
+        with self._reload_lock:
+            stamp = self._file_stamp()
+            snapshot = build_snapshot(self.csv_path, self.threshold, self.cache_size,
+                                      self.vocabulary_factory)
+            if self.current is not None:
+                self.reloads += 1
+            self.current = snapshot
+            self._stamp = stamp
+            self.last_error = None
+            return snapshot
+
+    def reload_if_changed(self):
+        """
+        Reload if the CSV or compiled cache changed since the last load. Returns
+        True if a new version was swapped in. A touched file with the same content
+        keeps the current snapshot (and its warm label cache).
+        """
+        stamp = self._file_stamp()
+        if stamp == self._stamp:
+            return False
+        try:
+            if self.current is not None and dataset_version(self.csv_path) == self.current.version:
+                self._stamp = stamp
+                return False
+            previous = self.current
+            snapshot = self.load()
+        except Exception as e:
+            # Keep serving the last good snapshot; try again on the next change
+            self._stamp = stamp
+            self.last_error = str(e)
+            logger.warning("Emissions reload failed, keeping the current data: %s", e)
+            return False
+        old_version = previous.version if previous is not None else None
+        logger.info("Emissions data reloaded: %s -> %s (%d rows)", old_version, snapshot.version,
+                    len(snapshot.carbon_data))
+        return True
+
+    def _watch(self, interval):
+        while not self._stop.wait(interval):
+            self.reload_if_changed()
+
+    def start_watcher(self, interval):
+        """
+        Poll for changes every interval seconds on a daemon thread. Threads don't
+        survive fork, so call this again in each worker process; it is a no-op if
+        this process already has a watcher.
+        """
+        if interval <= 0:
+            return
+        if self._watcher is not None and self._watcher_pid == os.getpid() and self._watcher.is_alive():
+            return
+        self._stop.clear()
+        self._watcher = threading.Thread(target=self._watch, args=(interval,),
+                                         name="emissions-watcher", daemon=True)
+        self._watcher_pid = os.getpid()
+        self._watcher.start()
+
+    def stop_watcher(self):
+        self._stop.set()
+
+    def stats(self):
+        snapshot = self.current
+        return {
+            "dataset_version": snapshot.version if snapshot is not None else None,
+            "rows": len(snapshot.carbon_data) if snapshot is not None else 0,
+            "loaded_at": snapshot.loaded_at if snapshot is not None else None,
+            "reloads": self.reloads,
+            "last_error": self.last_error,
+        }
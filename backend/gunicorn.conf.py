@@ -0,0 +1,70 @@
+# Production server settings for the Flask app (replaces `python app.py`).
+#
+#   pip install gunicorn
+#   cd backend && gunicorn -c gunicorn.conf.py
+#
+# Requests spend most of their time waiting on the model, so each worker process
+# runs a pool of threads (gthread) and the process count only has to cover the
+# CPU work (image decode/re-encode, JSON, carbon lookups). With preload the app is
+# imported once in the master, so the emissions table, name index and vocabulary
+# are built before fork and shared copy-on-write with every worker.
+#
+# SIGTERM (or SIGHUP for a rolling reload) stops accepting connections and gives
+# in-flight analyses up to graceful_timeout to finish before workers exit.
+#
+# Configured with environment variables:
+#   PORT                      listen port (default 5001)
+#   GUNICORN_WORKERS          worker processes (default: CPU count)
+#   GUNICORN_THREADS          request threads per worker (default 16)
+#   GUNICORN_PRELOAD          0 to import the app in each worker instead (default 1)
+#   GUNICORN_GRACEFUL_TIMEOUT seconds to drain on shutdown (default MODEL_TIMEOUT + 10)
+#
+# For the ASGI entry point (asgi.py) use uvicorn instead:
+#   uvicorn asgi:application --host 0.0.0.0 --port 5001 --workers 4
+
+import multiprocessing
+import os
+
+_model_timeout = float(os.environ.get("MODEL_TIMEOUT", "120"))
+
+wsgi_app = "app:app"
+bind = f"0.0.0.0:{os.environ.get('PORT', '5001')}"
+worker_class = "gthread"
+workers = int(os.environ.get("GUNICORN_WORKERS", str(multiprocessing.cpu_count())))
+threads = int(os.environ.get("GUNICORN_THREADS", "16"))
+preload_app = os.environ.get("GUNICORN_PRELOAD", "1") != "0"
+if preload_app:
+    # Load the heavy imports and the emissions data in the master, before fork
+    os.environ.setdefault("CARBONFORK_WARMUP", "eager")
+
+# A gthread worker's heartbeat doesn't depend on request length, so this only
+# catches a wedged process; still keep it above the model timeout
+timeout = int(_model_timeout) + 30
+graceful_timeout = int(os.environ.get("GUNICORN_GRACEFUL_TIMEOUT", str(int(_model_timeout) + 10)))
+keepalive = 5
+
+accesslog = "-"
+errorlog = "-"
+
+
+def post_fork(server, worker):
+    # Threads and client connections don't survive fork: give each worker its own
+    # Gemini client, emissions watcher and job workers
+    import app
+    import model_runner
+
+    app.warm_up()
+    model_runner.warm_up()
+    app.emissions_store.start_watcher(app.EMISSIONS_RELOAD_INTERVAL)
+    app.job_queue.start()
+
+
+def worker_exit(server, worker):
+    # Gunicorn has stopped handing out requests; let model calls already running
+    # on the pool finish so their requests can still respond. Background jobs stop
+    # claiming work; one cut off here is requeued by another worker later.
+    import app
+    import model_runner
+
+    app.job_queue.stop()
+    model_runner.shutdown(wait=True)
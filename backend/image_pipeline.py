@@ -0,0 +1,175 @@
+# Preprocessing for uploaded plate photos before they go to Gemini.
+#
+# Phone photos are 12+ MP and several MB; the model doesn't need that much to
+# identify food and guess portions, and sending it dominates upload time. Every
+# image is turned upright (EXIF orientation), scaled so its longest edge is at most
+# IMAGE_MAX_EDGE, stripped of metadata and saved as a JPEG whose quality is picked
+# to fit in IMAGE_TARGET_BYTES. Images with transparency stay PNG.
+#
+# JPEG/PNG uploads that already meet all of that are passed through byte-for-byte:
+# normalize_image only reads the header to decide, so they are never decoded.
+#
+# Configured with environment variables:
+#   IMAGE_MAX_EDGE       longest edge in pixels (default 1600)
+#   IMAGE_TARGET_BYTES   JPEG size budget in bytes (default 400000)
+#   IMAGE_MIN_QUALITY    lowest JPEG quality we'll go to for the budget (default 60)
+#   IMAGE_MAX_QUALITY    JPEG quality to start from (default 90)
+
+import math
+import os
+from io import BytesIO
+
+from PIL import Image, ImageOps
+
+import metrics
+
+# Optional HEIC support (install: pip install pillow-heif)
+try:
+    import pillow_heif
+    pillow_heif.register_heif_opener()
+except Exception:
+    pass  # If not installed, we'll still handle most cases via Pillow
+
+IMAGE_MAX_EDGE = int(os.environ.get("IMAGE_MAX_EDGE", "1600"))
+IMAGE_TARGET_BYTES = int(os.environ.get("IMAGE_TARGET_BYTES", "400000"))
+IMAGE_MIN_QUALITY = int(os.environ.get("IMAGE_MIN_QUALITY", "60"))
+IMAGE_MAX_QUALITY = int(os.environ.get("IMAGE_MAX_QUALITY", "90"))
+
+# Formats Gemini accepts as-is
+MODEL_MIMES = {"JPEG": "image/jpeg", "PNG": "image/png"}
+
+
+def _has_alpha(img):
+    return img.mode in ("RGBA", "LA", "PA") or (img.mode == "P" and "transparency" in img.info)
+
+
+def encode_jpeg(img, target_bytes=None, min_quality=None, max_quality=None):
+    """
+    Save img as a JPEG at the highest quality that fits target_bytes. Qualities are
+    tried in steps of 5 with a binary search, so this is at most 4 encodes.
+    If even min_quality is too big, min_quality is used.
+    """
+    target_bytes = IMAGE_TARGET_BYTES if target_bytes is None else target_bytes
+    low = IMAGE_MIN_QUALITY if min_quality is None else min_quality
+    high = IMAGE_MAX_QUALITY if max_quality is None else max_quality
+    qualities = sorted(set(range(low, high, 5)) | {high})
+
+    encoded = {}
+
+    def save(quality):
+        if quality not in encoded:
+            out = BytesIO()
+            img.save(out, format="JPEG", quality=quality)
+            encoded[quality] = out.getvalue()
+        return encoded[quality]
+
+    # Small images usually fit at the top quality straight away
+    if len(save(high)) <= target_bytes:
+        return save(high)
+
+    # Otherwise find the highest quality that fits
+    best = None
+    lo, hi = 0, len(qualities) - 2
+    while lo <= hi:
+        mid = (lo + hi) // 2
+        if len(save(qualities[mid])) <= target_bytes:
+            best, lo = mid, mid + 1
+        else:
+            hi = mid - 1
+    return save(qualities[best if best is not None else 0])
+
+
+def prepare_image(img, max_edge=None, target_bytes=None):
+    """
+    Downscale, orient and re-encode an opened Pillow image.
+    Returns (image_bytes, mime) ready for Part.from_data.
+    """
+    max_edge = IMAGE_MAX_EDGE if max_edge is None else max_edge
+
+    # decode covers reading the pixels, rotating and downscaling; encode the save
+    with metrics.timed("decode"):
+        # For big JPEGs let libjpeg decode straight to a reduced scale (1/2, 1/4, 1/8),
+        # which is much cheaper than decoding every pixel and then shrinking
+        if img.format == "JPEG" and max(img.size) >= 2 * max_edge:
+            # draft only scales down while both sides stay at least the requested size
+            scale = max_edge / max(img.size)
+            img.draft("RGB", (math.ceil(img.width * scale), math.ceil(img.height * scale)))
+
+        # Bake in the EXIF rotation, since we drop the metadata that carries it
+        img = ImageOps.exif_transpose(img)
+        if max(img.size) > max_edge:
+            img.thumbnail((max_edge, max_edge), Image.BICUBIC)
+
+        alpha = _has_alpha(img)
+        if alpha and img.mode not in ("RGBA", "LA"):
+            img = img.convert("RGBA")
+        elif not alpha and img.mode not in ("RGB", "L"):
+            img = img.convert("RGB")
+        img.load()
+
+    with metrics.timed("encode"):
+        if alpha:
+            # Preserve alpha by staying PNG
+            out = BytesIO()
+            img.save(out, format="PNG", optimize=True)
+            return out.getvalue(), "image/png"
+        return encode_jpeg(img, target_bytes), "image/jpeg"
+
+
+def passthrough_mime(img, size_bytes, max_edge=None, target_bytes=None):
+    """
+    The mime type to send the original bytes under, or None if the image needs
+    prepare_image. Only looks at header fields, so no pixels are decoded.
+    """
+    max_edge = IMAGE_MAX_EDGE if max_edge is None else max_edge
+    target_bytes = IMAGE_TARGET_BYTES if target_bytes is None else target_bytes
+
+    mime = MODEL_MIMES.get(img.format)
+    if mime is None:
+        return None
+    if max(img.size) > max_edge or size_bytes > target_bytes:
+        return None
+    if img.format == "JPEG" and img.mode not in ("RGB", "L"):
+        # CMYK/YCCK JPEGs get converted to RGB
+        return None
+    if "exif" in img.info or "xmp" in img.info:
+        # Orientation has to be applied and metadata (e.g. GPS) stripped
+        return None
+    return mime
+
+
+def normalize_image(source):
+    """
+    Returns (image_bytes, mime) suitable for Vertex Gemini from an upload, given as
+    bytes or as a seekable binary file (e.g. a spooled upload, so large files never
+    have to be copied into memory in full). Clean, small JPEG/PNG files are returned
+    untouched; everything else goes through prepare_image. Raises ValueError if the
+    upload can't be used.
+    """
+    if isinstance(source, (bytes, bytearray)):
+        source = BytesIO(source)
+    source.seek(0, os.SEEK_END)
+    size = source.tell()
+    source.seek(0)
+
+    if not size:
+        raise ValueError("Uploaded image is empty (0 bytes).")
+
+    # Try to open via Pillow; this also fixes many incorrect content-types.
+    # Image.open only parses the header; pixels are decoded on first use.
+    try:
+        img = Image.open(source)
+        mime = passthrough_mime(img, size)
+        if mime is not None:
+            source.seek(0)
+            return source.read(), mime
+        return prepare_image(img)
+    except Exception as e:
+        # If Pillow couldn't open it, try a last-resort: assume JPEG bytes
+        # (This covers rare cases where the file is valid but not recognized)
+        source.seek(0)
+        if source.read(2) == b"\xff\xd8":
+            # Looks like a JPEG magic header; pass through
+            source.seek(0)
+            return source.read(), "image/jpeg"
+        raise ValueError(f"Could not decode the uploaded image: {e}")
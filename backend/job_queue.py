@@ -0,0 +1,354 @@
+# Background jobs for /api/analyze-image?mode=async (and POST /api/jobs).
+#
+# Clients on flaky connections don't have to hold a request open for the whole
+# model round trip: they upload the photo, get a job ID back at once, and either
+# poll GET /api/jobs/<id> or have the result POSTed to a callback URL. A pool of
+# worker threads runs the analysis (preprocess, model, carbon).
+#
+# Jobs live in SQLite, so every gunicorn worker on the host shares one queue: any
+# process can claim a job and any can answer a poll. A job whose process died
+# mid-run is put back on the queue once it has been running for JOB_STALE_AFTER
+# seconds, up to JOB_MAX_ATTEMPTS runs.
+#
+# Submitting the same photo (same bytes and finger_length) while an earlier job
+# for it is queued, running or done returns that job instead of starting another.
+#
+# Configured with environment variables:
+#   JOB_QUEUE_PATH        SQLite file (default job_queue.sqlite3)
+#   JOB_WORKERS           worker threads per process (default 4)
+#   JOB_POLL_INTERVAL     seconds between queue checks when idle (default 1)
+#   JOB_RETENTION         seconds finished jobs are kept (default 86400)
+#   JOB_STALE_AFTER       seconds before a running job is presumed lost (default 300)
+#   JOB_MAX_ATTEMPTS      runs before a job that keeps getting lost fails (default 3)
+#   JOB_CALLBACK_HOSTS    comma-separated hosts callbacks may go to (default: any)
+#   JOB_CALLBACK_RETRIES  delivery attempts per callback (default 3)
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import urllib.parse
+import urllib.request
+import uuid
+from contextlib import contextmanager
+
+import logs
+
+logger = logs.get_logger("jobs")
+
+# Finished jobs whose timings feed the latency percentiles
+STATS_WINDOW = 1000
+MAINTENANCE_INTERVAL = 60
+
+
+class JobError(Exception):
+    """A job failed in a way the client should see; carries the JSON error body."""
+
+    def __init__(self, payload):
+        super().__init__(payload.get("error"))
+        self.payload = payload
+
+
+def dedupe_key(image_bytes, finger_length):
+    return f"{hashlib.sha256(image_bytes).hexdigest()}:{finger_length}"
+
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list (None if it's empty)."""
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))]
+
+
+def _latency_summary(seconds):
+    seconds = sorted(seconds)
+    return {
+        "p50_ms": round(percentile(seconds, 0.50) * 1000, 1) if seconds else None,
+        "p95_ms": round(percentile(seconds, 0.95) * 1000, 1) if seconds else None,
+        "p99_ms": round(percentile(seconds, 0.99) * 1000, 1) if seconds else None,
+        "max_ms": round(seconds[-1] * 1000, 1) if seconds else None,
+    }
+
+
+class JobQueue:
+    """
+    SQLite-backed job queue plus this process's worker threads. runner(image_bytes,
+    finger_length) does the work and returns the result payload; it raises JobError
+    for a failure the client should see.
+    """
+
+    def __init__(self, path, runner, workers=4, poll_interval=1.0, retention=86400, stale_after=300,
+                 max_attempts=3, callback_hosts=None, callback_retries=3):
+        self.path = path
+        self.runner = runner
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.retention = retention
+        self.stale_after = stale_after
+        self.max_attempts = max_attempts
+        self.callback_hosts = set(callback_hosts or [])
+        self.callback_retries = callback_retries
+        self._local = threading.local()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._threads = []
+        self._threads_pid = None
+        self._start_lock = threading.Lock()
+        self._maintained_at = 0.0
+
+    def _connect(self):
+        # One connection per thread, in autocommit mode so _transaction can BEGIN
+        # IMMEDIATE: the dedupe check and the claim must not race other processes
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                " id TEXT PRIMARY KEY, dedupe_key TEXT NOT NULL, status TEXT NOT NULL,"
+                " image BLOB, finger_length REAL NOT NULL, callback_url TEXT,"
+                " result TEXT, error TEXT, attempts INTEGER NOT NULL DEFAULT 0,"
+                " created_at REAL NOT NULL, started_at REAL, finished_at REAL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at)")
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_dedupe ON jobs (dedupe_key, created_at)")
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def _transaction(self):
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    def check_callback_url(self, url):
+        """Raises ValueError unless url is an http(s) URL on an allowed host."""
+        parsed = urllib.parse.urlparse(url)
+        if parsed.scheme not in ("http", "https") or not parsed.hostname:
+            raise ValueError("callback_url must be an http or https URL")
+        if self.callback_hosts and parsed.hostname not in self.callback_hosts:
+            raise ValueError(f"callback_url host {parsed.hostname} is not allowed")
+
+    @staticmethod
+    def _view(row):
+        """The job as clients see it."""
+        job = {
+            "job_id": row["id"],
+            "status": row["status"],
+            "created_at": row["created_at"],
+            "started_at": row["started_at"],
+            "finished_at": row["finished_at"],
+            "attempts": row["attempts"],
+        }
+        if row["result"] is not None:
+            job["result"] = json.loads(row["result"])
+        if row["error"] is not None:
+            job["error"] = json.loads(row["error"])
+        return job
+
+    def submit(self, image_bytes, finger_length, callback_url=None):
+        """
+        Queue a job, or find the live one for the same photo. Returns (job, deduplicated).
+        Raises ValueError for a callback URL we won't call.
+        """
+        if callback_url:
+            self.check_callback_url(callback_url)
+        key = dedupe_key(image_bytes, finger_length)
+        now = time.time()
+        with self._transaction() as conn:
+            row = conn.execute(
+                "SELECT * FROM jobs WHERE dedupe_key = ? AND status != 'failed' ORDER BY created_at DESC LIMIT 1",
+                (key,),
+            ).fetchone()
+            if row is None:
+                job_id = uuid.uuid4().hex
+                conn.execute(
+                    "INSERT INTO jobs (id, dedupe_key, status, image, finger_length, callback_url, created_at)"
+                    " VALUES (?, ?, 'queued', ?, ?, ?, ?)",
+                    (job_id, key, sqlite3.Binary(image_bytes), finger_length, callback_url, now),
+                )
+                row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+                deduplicated = False
+            else:
+                if callback_url and row["status"] != "done" and not row["callback_url"]:
+                    conn.execute("UPDATE jobs SET callback_url = ? WHERE id = ?", (callback_url, row["id"]))
+                deduplicated = True
+
+        job = self._view(row)
+        if not deduplicated:
+            self._wake.set()
+        elif callback_url and job["status"] == "done":
+            # Already finished: this caller still gets its callback
+            self._deliver_later(callback_url, job)
+        return job, deduplicated
+
+    def get(self, job_id):
+        row = self._connect().execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._view(row) if row is not None else None
+
+    def _claim(self):
+        with self._transaction() as conn:
+            row = conn.execute(
+                "SELECT id FROM jobs WHERE status = 'queued' ORDER BY created_at LIMIT 1"
+            ).fetchone()
+            if row is None:
+                return None
+            conn.execute(
+                "UPDATE jobs SET status = 'running', started_at = ?, attempts = attempts + 1 WHERE id = ?",
+                (time.time(), row["id"]),
+            )
+            return conn.execute("SELECT * FROM jobs WHERE id = ?", (row["id"],)).fetchone()
+
+    def _finish(self, job_id, status, result=None, error=None):
+        with self._transaction() as conn:
+            # The image is only needed to run the job
+            conn.execute(
+                "UPDATE jobs SET status = ?, result = ?, error = ?, finished_at = ?, image = NULL WHERE id = ?",
+                (status, json.dumps(result) if result is not None else None,
+                 json.dumps(error) if error is not None else None, time.time(), job_id),
+            )
+            row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row["callback_url"]:
+            self._deliver_later(row["callback_url"], self._view(row))
+
+    def _run(self, row):
+        try:
+            result = self.runner(bytes(row["image"]), row["finger_length"])
+        except JobError as e:
+            self._finish(row["id"], "failed", error=e.payload)
+        except Exception as e:
+            logger.exception("Job %s failed", row["id"])
+            self._finish(row["id"], "failed", error={"success": False, "error": str(e)})
+        else:
+            self._finish(row["id"], "done", result=result)
+
+    def _deliver(self, url, job):
+        body = json.dumps(job).encode("utf-8")
+        for attempt in range(self.callback_retries):
+            req = urllib.request.Request(url, data=body, headers={"Content-Type": "application/json"})
+            try:
+                with urllib.request.urlopen(req, timeout=10) as resp:
+                    resp.read()
+                return
+            except OSError as e:
+                logger.warning("Callback for job %s to %s failed (attempt %d): %s", job["job_id"], url, attempt + 1, e)
+                if attempt + 1 < self.callback_retries:
+                    time.sleep(2 ** attempt)
+
+    def _deliver_later(self, url, job):
+        # Off the worker thread, so a slow receiver doesn't hold up the queue
+        threading.Thread(target=self._deliver, args=(url, job), name="job-callback", daemon=True).start()
+
+    def maintain(self):
+        """Requeue (or fail) jobs whose process died mid-run and drop expired ones."""
+        now = time.time()
+        with self._transaction() as conn:
+            conn.execute(
+                "UPDATE jobs SET status = 'failed', finished_at = ?, image = NULL, error = ?"
+                " WHERE status = 'running' AND started_at < ? AND attempts >= ?",
+                (now, json.dumps({"success": False, "error": "Job was lost by its worker too many times"}),
+                 now - self.stale_after, self.max_attempts),
+            )
+            requeued = conn.execute(
+                "UPDATE jobs SET status = 'queued', started_at = NULL WHERE status = 'running' AND started_at < ?",
+                (now - self.stale_after,),
+            ).rowcount
+            conn.execute("DELETE FROM jobs WHERE finished_at < ?", (now - self.retention,))
+        if requeued:
+            logger.warning("Requeued %d job(s) left running by a lost worker", requeued)
+            self._wake.set()
+
+    def _maybe_maintain(self):
+        with self._start_lock:
+            if time.time() - self._maintained_at < MAINTENANCE_INTERVAL:
+                return
+            self._maintained_at = time.time()
+        try:
+            self.maintain()
+        except sqlite3.Error as e:
+            logger.error("Job queue maintenance failed: %s", e)
+
+    def _work(self):
+        while not self._stop.is_set():
+            try:
+                row = self._claim()
+            except sqlite3.Error as e:
+                logger.error("Job queue claim failed: %s", e)
+                row = None
+            if row is None:
+                self._maybe_maintain()
+                self._wake.wait(self.poll_interval)
+                self._wake.clear()
+                continue
+            self._run(row)
+
+    def start(self):
+        """
+        Start this process's worker threads. Threads don't survive fork, so call
+        this in each worker process; it is a no-op if they're already running here.
+        """
+        if self._threads_pid == os.getpid() and any(thread.is_alive() for thread in self._threads):
+            return
+        with self._start_lock:
+            if self._threads_pid == os.getpid() and any(thread.is_alive() for thread in self._threads):
+                return
+            self._stop.clear()
+            self._local = threading.local()
+            self._threads = [threading.Thread(target=self._work, name=f"job-worker-{i}", daemon=True)
+                             for i in range(self.workers)]
+            self._threads_pid = os.getpid()
+            for thread in self._threads:
+                thread.start()
+
+    def stop(self):
+        """Stop claiming new jobs; ones already running finish on their threads."""
+        self._stop.set()
+        self._wake.set()
+
+    def stats(self):
+        """Queue depth by status and latency percentiles over the last finished jobs."""
+        conn = self._connect()
+        counts = {row["status"]: row["n"] for row in
+                  conn.execute("SELECT status, COUNT(*) AS n FROM jobs GROUP BY status")}
+        rows = conn.execute(
+            "SELECT created_at, started_at, finished_at FROM jobs"
+            " WHERE finished_at IS NOT NULL AND started_at IS NOT NULL ORDER BY finished_at DESC LIMIT ?",
+            (STATS_WINDOW,),
+        ).fetchall()
+        return {
+            "queue_depth": counts.get("queued", 0),
+            "running": counts.get("running", 0),
+            "done": counts.get("done", 0),
+            "failed": counts.get("failed", 0),
+            "workers": sum(thread.is_alive() for thread in self._threads) if self._threads_pid == os.getpid() else 0,
+            "latency": {
+                "jobs": len(rows),
+                "queue_wait": _latency_summary([row["started_at"] - row["created_at"] for row in rows]),
+                "run": _latency_summary([row["finished_at"] - row["started_at"] for row in rows]),
+                "total": _latency_summary([row["finished_at"] - row["created_at"] for row in rows]),
+            },
+        }
+
+
+def make_job_queue(runner):
+    """Build the queue described by the JOB_* environment variables."""
+    hosts = [host.strip() for host in os.environ.get("JOB_CALLBACK_HOSTS", "").split(",") if host.strip()]
+    return JobQueue(
+        os.environ.get("JOB_QUEUE_PATH", "job_queue.sqlite3"),
+        runner,
+        workers=int(os.environ.get("JOB_WORKERS", "4")),
+        poll_interval=float(os.environ.get("JOB_POLL_INTERVAL", "1")),
+        retention=float(os.environ.get("JOB_RETENTION", "86400")),
+        stale_after=float(os.environ.get("JOB_STALE_AFTER", "300")),
+        max_attempts=int(os.environ.get("JOB_MAX_ATTEMPTS", "3")),
+        callback_hosts=hosts,
+        callback_retries=int(os.environ.get("JOB_CALLBACK_RETRIES", "3")),
+    )
@@ -0,0 +1,46 @@
+# Leveled logging for the backend, replacing the print() debugging.
+#
+# Per-request detail (upload headers, the raw model reply, detected foods) is
+# logged at DEBUG and sampled: guard it with should_log(logger), which is a level
+# check plus, when sampling, one random draw, so with DEBUG off the message and its
+# arguments are never built.
+#
+# Configured with environment variables:
+#   LOG_LEVEL         DEBUG, INFO, WARNING or ERROR (default INFO)
+#   LOG_SAMPLE_RATE   fraction of per-request DEBUG messages kept (default 1.0)
+
+import logging
+import os
+import random
+
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+LOG_SAMPLE_RATE = float(os.environ.get("LOG_SAMPLE_RATE", "1.0"))
+
+_configured = False
+
+
+def configure():
+    """Send carbonfork.* records to stderr at LOG_LEVEL. Safe to call more than once."""
+    global _configured
+    if _configured:
+        return
+    logger = logging.getLogger("carbonfork")
+    logger.setLevel(LOG_LEVEL)
+    if not logger.handlers:
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s [%(process)d] %(name)s: %(message)s"))
+        logger.addHandler(handler)
+        # gunicorn (or a host app) may configure the root logger too; don't print twice
+        logger.propagate = False
+    _configured = True
+
+
+def get_logger(name):
+    return logging.getLogger(f"carbonfork.{name}")
+
+
+def should_log(logger, level=logging.DEBUG):
+    """True if a sampled per-request message at level would be emitted."""
+    if not logger.isEnabledFor(level):
+        return False
+    return LOG_SAMPLE_RATE >= 1.0 or random.random() < LOG_SAMPLE_RATE
@@ -0,0 +1,136 @@
+# Per-stage latency for the analyze pipeline, plus plain value counters (e.g.
+# per-request peak upload memory) and event counts (e.g. model replies that failed
+# to parse). Served as JSON at /api/metrics and in the Prometheus text format at
+# /metrics, where each stage is a histogram over LATENCY_BUCKETS.
+#
+# Everything here is per process: under gunicorn each worker keeps its own, so
+# scrape every worker (or sum across the pid label) for the whole picture.
+
+import bisect
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# Histogram bucket upper bounds in seconds; the model call dominates, so they
+# reach well past a typical Gemini round trip
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+_lock = threading.Lock()
+_stages = {}
+_values = {}
+_counters = {}
+
+
+def record(stage, seconds):
+    with _lock:
+        stats = _stages.get(stage)
+        if stats is None:
+            stats = _stages[stage] = {"count": 0, "total": 0.0, "max": 0.0,
+                                      "buckets": [0] * (len(LATENCY_BUCKETS) + 1)}
+        stats["count"] += 1
+        stats["total"] += seconds
+        stats["max"] = max(stats["max"], seconds)
+        stats["buckets"][bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+
+
+@contextmanager
+def timed(stage):
+    """Time the body of a with-block and record it under stage."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(stage, time.perf_counter() - start)
+
+
+def snapshot():
+    with _lock:
+        return {
+            stage: {
+                "count": stats["count"],
+                "mean_ms": round(stats["total"] / stats["count"] * 1000, 3),
+                "max_ms": round(stats["max"] * 1000, 3),
+                "total_s": round(stats["total"], 3),
+            }
+            for stage, stats in _stages.items()
+        }
+
+
+def record_value(name, value):
+    with _lock:
+        stats = _values.setdefault(name, {"count": 0, "total": 0, "max": 0, "last": 0})
+        stats["count"] += 1
+        stats["total"] += value
+        stats["max"] = max(stats["max"], value)
+        stats["last"] = value
+
+
+def value_snapshot():
+    with _lock:
+        return {
+            name: {
+                "count": stats["count"],
+                "mean": round(stats["total"] / stats["count"], 3),
+                "max": stats["max"],
+                "last": stats["last"],
+            }
+            for name, stats in _values.items()
+        }
+
+
+def increment(name, amount=1):
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + amount
+
+
+def counter_snapshot():
+    with _lock:
+        return dict(_counters)
+
+
+def _label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def prometheus_text(counters=None, gauges=None, prefix="carbonfork"):
+    """
+    Everything recorded here in the Prometheus text exposition format, plus extra
+    counters and gauges ({name: value}) the caller keeps elsewhere.
+    """
+    pid = os.getpid()
+    with _lock:
+        stages = {stage: (stats["count"], stats["total"], list(stats["buckets"])) for stage, stats in _stages.items()}
+        values = {name: dict(stats) for name, stats in _values.items()}
+        all_counters = dict(_counters)
+    all_counters.update(counters or {})
+
+    lines = [
+        f"# HELP {prefix}_stage_seconds Time spent in each stage of the analyze pipeline.",
+        f"# TYPE {prefix}_stage_seconds histogram",
+    ]
+    for stage, (count, total, buckets) in sorted(stages.items()):
+        labels = f'stage="{_label(stage)}",pid="{pid}"'
+        cumulative = 0
+        for bound, n in zip(LATENCY_BUCKETS, buckets):
+            cumulative += n
+            lines.append(f'{prefix}_stage_seconds_bucket{{{labels},le="{bound:g}"}} {cumulative}')
+        lines.append(f'{prefix}_stage_seconds_bucket{{{labels},le="+Inf"}} {count}')
+        lines.append(f"{prefix}_stage_seconds_sum{{{labels}}} {total:.6f}")
+        lines.append(f"{prefix}_stage_seconds_count{{{labels}}} {count}")
+
+    for name, value in sorted(all_counters.items()):
+        lines.append(f"# TYPE {prefix}_{name}_total counter")
+        lines.append(f'{prefix}_{name}_total{{pid="{pid}"}} {value}')
+
+    for name, stats in sorted(values.items()):
+        lines.append(f"# TYPE {prefix}_{name} summary")
+        lines.append(f'{prefix}_{name}_sum{{pid="{pid}"}} {stats["total"]}')
+        lines.append(f'{prefix}_{name}_count{{pid="{pid}"}} {stats["count"]}')
+
+    for name, value in sorted((gauges or {}).items()):
+        if value is None:
+            continue
+        lines.append(f"# TYPE {prefix}_{name} gauge")
+        lines.append(f'{prefix}_{name}{{pid="{pid}"}} {value}')
+    return "\n".join(lines) + "\n"
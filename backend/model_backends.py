@@ -0,0 +1,461 @@
+# Vision-model backends behind model_runner.
+#
+# Every backend takes the same model-neutral request, a list of prompt strings and
+# ImagePart(data, mime_type) images, plus an optional JSON response schema, and
+# returns an object with .text, so the rest of the pipeline doesn't know which one
+# it is talking to. generate_stream yields the reply text in chunks as the model
+# produces it instead:
+#   vertex   Gemini on Vertex AI
+#   http     POST to a fake model server (benchmarks/fake_model_server.py)
+#   stub     in-process canned reply with configurable latency and error rates;
+#            needs no network and no Google SDK
+#   record   wrap another backend and save every reply under a hash of its request
+#   replay   answer only from saved replies
+#
+# Configured with environment variables:
+#   MODEL_BACKEND          vertex, http, stub, record or replay (default vertex, or
+#                          http when CARBONFORK_MODEL_URL is set)
+#   CARBONFORK_MODEL_URL   fake server URL for the http backend
+#   STUB_RESPONSE          JSON file the stub replies with (default api_response.json)
+#   STUB_LATENCY           mean seconds per reply (default 0)
+#   STUB_LATENCY_DIST      fixed, uniform, exponential or lognormal (default fixed)
+#   STUB_JITTER            +/- seconds for uniform, sigma for lognormal (default 0)
+#   STUB_ERROR_RATE        fraction of calls that raise ModelBackendError (default 0)
+#   STUB_QUOTA_RATE        fraction of calls that raise ModelQuotaError, like Vertex
+#                          rejecting a call over quota (default 0)
+#   STUB_MALFORMED_RATE    fraction of replies that aren't valid JSON (default 0)
+#   STUB_SEED              random seed, for reproducible runs
+#   STUB_STREAM_CHUNKS     chunks a streamed stub reply is split into; the latency
+#                          is spread across them (default 8)
+#   MODEL_RECORD_DIR       where record writes and replay reads (default model_recordings)
+#   MODEL_RECORD_BACKEND   the backend record wraps (default vertex)
+
+import asyncio
+import hashlib
+import json
+import math
+import os
+import random
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from collections import namedtuple
+
+import logs
+import metrics
+
+logger = logs.get_logger("model")
+
+VERTEX_PROJECT = "carbonfork"
+VERTEX_LOCATION = "us-central1"
+MODEL_NAME = "gemini-2.5-pro"
+
+DEFAULT_STUB_RESPONSE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "api_response.json")
+
+ImagePart = namedtuple("ImagePart", ["data", "mime_type"])
+
+
+class ModelBackendError(Exception):
+    """The backend failed to produce a reply."""
+
+
+class ModelQuotaError(ModelBackendError):
+    """
+    The provider turned the call down for quota or rate limits (HTTP 429 /
+    RESOURCE_EXHAUSTED); worth retrying after a pause. retry_after is the wait the
+    provider asked for, in seconds, if it gave one.
+    """
+
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def is_quota_error(error):
+    # google.api_core's ResourceExhausted and TooManyRequests, like urllib's
+    # HTTPError, carry the HTTP status as .code
+    return getattr(error, "code", None) == 429
+
+
+def retry_after_seconds(headers):
+    """A Retry-After header in seconds, or None (HTTP-date values aren't worth parsing here)."""
+    try:
+        return float(headers.get("Retry-After"))
+    except (TypeError, ValueError):
+        return None
+
+
+class TextResponse:
+    """Minimal stand-in for a GenerationResponse; we only ever read .text"""
+
+    def __init__(self, text):
+        self.text = text
+
+
+def request_key(contents, response_schema=None):
+    """Stable hash of a request, used to file recorded replies."""
+    digest = hashlib.sha256()
+    if response_schema is not None:
+        digest.update(b"schema:" + json.dumps(response_schema, sort_keys=True).encode("utf-8") + b"\0")
+    for part in contents:
+        if isinstance(part, ImagePart):
+            digest.update(b"image:" + part.mime_type.encode("utf-8") + b"\0")
+            digest.update(part.data)
+        else:
+            digest.update(b"text:" + str(part).encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+class VertexBackend:
+    """Gemini through the Vertex AI SDK, one shared GenerativeModel per process."""
+
+    name = "vertex"
+
+    def __init__(self, model_name=MODEL_NAME, project=VERTEX_PROJECT, location=VERTEX_LOCATION):
+        self.model_name = model_name
+        self.project = project
+        self.location = location
+        self._sdk = None
+        self._model = None
+        self._model_pid = None
+        self._lock = threading.Lock()
+
+    def _generative_models(self):
+        # Importing the SDK takes seconds, so it waits until a call needs it
+        if self._sdk is None:
+            with self._lock:
+                if self._sdk is None:
+                    import vertexai
+                    from vertexai import generative_models
+
+                    vertexai.init(project=self.project, location=self.location)
+                    self._sdk = generative_models
+        return self._sdk
+
+    def model(self):
+        """
+        The process's GenerativeModel. Rebuilt in a forked child, since the parent's
+        connections can't be reused across a fork.
+        """
+        if self._model is not None and self._model_pid == os.getpid():
+            return self._model
+        sdk = self._generative_models()
+        with self._lock:
+            if self._model is None or self._model_pid != os.getpid():
+                with metrics.timed("client_setup"):
+                    self._model = sdk.GenerativeModel(self.model_name)
+                    self._model_pid = os.getpid()
+        return self._model
+
+    def _sdk_contents(self, contents):
+        Part = self._generative_models().Part
+        return [Part.from_data(data=part.data, mime_type=part.mime_type) if isinstance(part, ImagePart) else part
+                for part in contents]
+
+    def _generation_config(self, response_schema):
+        # Structured output: the model has to answer with JSON matching the schema
+        if response_schema is None:
+            return None
+        return self._generative_models().GenerationConfig(
+            response_mime_type="application/json",
+            response_schema=response_schema,
+        )
+
+    def warm_up(self):
+        model = self.model()
+        if os.environ.get("MODEL_WARMUP_PING") == "1":
+            try:
+                model.count_tokens("ping")
+            except Exception as e:
+                logger.warning("Model warm-up ping failed: %s", e)
+
+    def generate(self, contents, response_schema=None):
+        try:
+            return self.model().generate_content(self._sdk_contents(contents),
+                                                 generation_config=self._generation_config(response_schema))
+        except Exception as e:
+            if is_quota_error(e):
+                raise ModelQuotaError(f"Vertex quota exceeded: {e}") from e
+            raise
+
+    async def generate_async(self, contents, response_schema=None):
+        try:
+            return await self.model().generate_content_async(
+                self._sdk_contents(contents), generation_config=self._generation_config(response_schema))
+        except Exception as e:
+            if is_quota_error(e):
+                raise ModelQuotaError(f"Vertex quota exceeded: {e}") from e
+            raise
+
+    def generate_stream(self, contents, response_schema=None):
+        try:
+            responses = self.model().generate_content(self._sdk_contents(contents),
+                                                      generation_config=self._generation_config(response_schema),
+                                                      stream=True)
+            for response in responses:
+                # The last chunk can carry only the finish reason, with no text part
+                if response.candidates and response.candidates[0].content.parts:
+                    yield response.text
+        except Exception as e:
+            if is_quota_error(e):
+                raise ModelQuotaError(f"Vertex quota exceeded: {e}") from e
+            raise
+
+
+class HTTPBackend:
+    """
+    POSTs the prompt text to a fake model server and returns its {"text": ...} reply.
+    Streamed, the server answers with one {"text": ...} line per chunk.
+    """
+
+    name = "http"
+
+    def __init__(self, url, executor=None):
+        self.url = url
+        # Thread pool for generate_async (None means the event loop's default)
+        self.executor = executor
+
+    def warm_up(self):
+        pass
+
+    def _request(self, contents, response_schema, stream=False):
+        payload = json.dumps({
+            "model": MODEL_NAME,
+            "texts": [part for part in contents if isinstance(part, str)],
+            "parts": len(contents),
+            "response_schema": response_schema,
+            "stream": stream,
+        }).encode("utf-8")
+        return urllib.request.Request(self.url, data=payload, headers={"Content-Type": "application/json"})
+
+    def _open(self, request):
+        try:
+            return urllib.request.urlopen(request)
+        except urllib.error.HTTPError as e:
+            if is_quota_error(e):
+                raise ModelQuotaError(f"Model server quota exceeded: {e.reason}",
+                                      retry_after=retry_after_seconds(e.headers)) from e
+            raise
+
+    def generate(self, contents, response_schema=None):
+        with self._open(self._request(contents, response_schema)) as resp:
+            return TextResponse(json.loads(resp.read())["text"])
+
+    def generate_stream(self, contents, response_schema=None):
+        with self._open(self._request(contents, response_schema, stream=True)) as resp:
+            for line in resp:
+                if line.strip():
+                    yield json.loads(line)["text"]
+
+    async def generate_async(self, contents, response_schema=None):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, self.generate, contents,
+                                                                response_schema)
+
+
+class StubBackend:
+    """
+    Local deterministic stand-in: replies with canned JSON (api_response.json in a
+    ```json fence, like Gemini in free-text mode, or bare when a response schema is
+    given) after a sampled latency, and fails, runs out of quota or returns
+    malformed output at the configured rates. With a seed, runs are repeatable.
+    """
+
+    name = "stub"
+
+    def __init__(self, response_text=None, latency=0.0, distribution="fixed", jitter=0.0,
+                 error_rate=0.0, malformed_rate=0.0, seed=None, stream_chunks=8, quota_rate=0.0):
+        if response_text is None:
+            with open(DEFAULT_STUB_RESPONSE) as f:
+                response_text = f.read().strip()
+        if distribution not in ("fixed", "uniform", "exponential", "lognormal"):
+            raise ValueError(f"Unknown latency distribution: {distribution}")
+        self.response_text = response_text
+        self.latency = latency
+        self.distribution = distribution
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.quota_rate = quota_rate
+        self.malformed_rate = malformed_rate
+        self.stream_chunks = max(1, stream_chunks)
+        self.calls = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls):
+        response_text = None
+        if os.environ.get("STUB_RESPONSE"):
+            with open(os.environ["STUB_RESPONSE"]) as f:
+                response_text = f.read().strip()
+        seed = os.environ.get("STUB_SEED")
+        return cls(
+            response_text=response_text,
+            latency=float(os.environ.get("STUB_LATENCY", "0")),
+            distribution=os.environ.get("STUB_LATENCY_DIST", "fixed"),
+            jitter=float(os.environ.get("STUB_JITTER", "0")),
+            error_rate=float(os.environ.get("STUB_ERROR_RATE", "0")),
+            malformed_rate=float(os.environ.get("STUB_MALFORMED_RATE", "0")),
+            seed=int(seed) if seed else None,
+            stream_chunks=int(os.environ.get("STUB_STREAM_CHUNKS", "8")),
+            quota_rate=float(os.environ.get("STUB_QUOTA_RATE", "0")),
+        )
+
+    def _sample_latency(self, rng):
+        if self.latency <= 0:
+            return 0.0
+        if self.distribution == "uniform":
+            return max(0.0, self.latency + rng.uniform(-self.jitter, self.jitter))
+        if self.distribution == "exponential":
+            return rng.expovariate(1.0 / self.latency)
+        if self.distribution == "lognormal":
+            # Mean stays at latency; jitter is the sigma of the underlying normal
+            sigma = self.jitter
+            return rng.lognormvariate(math.log(self.latency) - sigma * sigma / 2, sigma)
+        return self.latency
+
+    def _plan(self):
+        # Draw everything for one call under the lock so a seeded run is repeatable
+        with self._lock:
+            self.calls += 1
+            delay = self._sample_latency(self._random)
+            # One draw for both kinds of failure, so seeded runs without quota errors don't change
+            draw = self._random.random()
+            fail = None
+            if draw < self.error_rate:
+                fail = "error"
+            elif draw < self.error_rate + self.quota_rate:
+                fail = "quota"
+            malformed = self._random.random() < self.malformed_rate
+        return delay, fail, malformed
+
+    def _reply(self, fail, malformed, response_schema):
+        if fail == "quota":
+            raise ModelQuotaError("Stub model quota exceeded (simulated)")
+        if fail:
+            raise ModelBackendError("Stub model error (simulated)")
+        text = self.response_text if response_schema is not None else "```json\n" + self.response_text + "\n```"
+        if malformed:
+            return TextResponse(text[:len(text) // 2])
+        return TextResponse(text)
+
+    def warm_up(self):
+        pass
+
+    def generate(self, contents, response_schema=None):
+        delay, fail, malformed = self._plan()
+        if delay:
+            time.sleep(delay)
+        return self._reply(fail, malformed, response_schema)
+
+    async def generate_async(self, contents, response_schema=None):
+        delay, fail, malformed = self._plan()
+        if delay:
+            await asyncio.sleep(delay)
+        return self._reply(fail, malformed, response_schema)
+
+    def generate_stream(self, contents, response_schema=None):
+        # Same reply, cut into even chunks that arrive evenly over the latency
+        delay, fail, malformed = self._plan()
+        text = self._reply(fail, malformed, response_schema).text
+        size = -(-len(text) // self.stream_chunks)
+        for start in range(0, len(text), size):
+            if delay:
+                time.sleep(delay / self.stream_chunks)
+            yield text[start:start + size]
+
+
+class RecordingBackend:
+    """Passes calls to another backend and saves each reply as <request_key>.json."""
+
+    name = "record"
+
+    def __init__(self, inner, directory):
+        self.inner = inner
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _save(self, key, response):
+        record = {"text": response.text, "backend": self.inner.name, "recorded_at": time.time()}
+        # Write then rename, so replay never reads a half-written file
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            json.dump(record, f)
+        os.replace(tmp_path, os.path.join(self.directory, key + ".json"))
+
+    def warm_up(self):
+        self.inner.warm_up()
+
+    def generate(self, contents, response_schema=None):
+        response = self.inner.generate(contents, response_schema)
+        self._save(request_key(contents, response_schema), response)
+        return response
+
+    async def generate_async(self, contents, response_schema=None):
+        response = await self.inner.generate_async(contents, response_schema)
+        await asyncio.to_thread(self._save, request_key(contents, response_schema), response)
+        return response
+
+    def generate_stream(self, contents, response_schema=None):
+        # Saved only once the stream has finished, so replay never sees a partial reply
+        chunks = []
+        for chunk in self.inner.generate_stream(contents, response_schema):
+            chunks.append(chunk)
+            yield chunk
+        self._save(request_key(contents, response_schema), TextResponse("".join(chunks)))
+
+
+class ReplayBackend:
+    """Answers from replies saved by RecordingBackend; a request never seen raises."""
+
+    name = "replay"
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def warm_up(self):
+        if not os.path.isdir(self.directory):
+            logger.warning("No recorded model replies in %s", self.directory)
+
+    def generate(self, contents, response_schema=None):
+        key = request_key(contents, response_schema)
+        try:
+            with open(os.path.join(self.directory, key + ".json")) as f:
+                return TextResponse(json.load(f)["text"])
+        except FileNotFoundError:
+            raise ModelBackendError(f"No recorded reply for request {key[:12]}")
+
+    async def generate_async(self, contents, response_schema=None):
+        return self.generate(contents, response_schema)
+
+    def generate_stream(self, contents, response_schema=None):
+        yield self.generate(contents, response_schema).text
+
+
+def make_backend(kind=None, executor=None):
+    """
+    Build the backend described by MODEL_BACKEND and friends. executor is the thread
+    pool backends without a native async API use for generate_async.
+    """
+    url = os.environ.get("CARBONFORK_MODEL_URL")
+    kind = (kind or os.environ.get("MODEL_BACKEND") or ("http" if url else "vertex")).lower()
+    record_dir = os.environ.get("MODEL_RECORD_DIR", "model_recordings")
+
+    if kind == "vertex":
+        return VertexBackend()
+    if kind == "http":
+        if not url:
+            raise ValueError("MODEL_BACKEND=http needs CARBONFORK_MODEL_URL")
+        return HTTPBackend(url, executor=executor)
+    if kind == "stub":
+        return StubBackend.from_env()
+    if kind == "record":
+        inner = os.environ.get("MODEL_RECORD_BACKEND", "vertex")
+        if inner == "record":
+            raise ValueError("MODEL_RECORD_BACKEND can't be record")
+        return RecordingBackend(make_backend(inner, executor), record_dir)
+    if kind == "replay":
+        return ReplayBackend(record_dir)
+    raise ValueError(f"Unknown MODEL_BACKEND: {kind}")
@@ -0,0 +1,170 @@
+# Getting the list of detected foods out of a model reply.
+#
+# The request asks for structured output (FOOD_SCHEMA, sent as the response
+# schema with response_mime_type application/json), so the reply is normally
+# bare JSON. Replies from backends without schema support, or from the model
+# misbehaving, still go through FoodStreamParser: it finds the array wherever
+# it starts (after prose, inside a ```json fence), yields each food object as
+# soon as it is complete, and ignores whatever follows. If the reply is cut off,
+# the foods that were complete are still recovered.
+#
+# When a reply can't be used, repair_contents() builds a cheap text-only
+# follow-up request (no image) asking the model to turn its own reply into
+# valid JSON.
+
+import json
+import re
+
+FOOD_SCHEMA = {
+    "type": "array",
+    "items": {
+        "type": "object",
+        "properties": {
+            "food_item": {"type": "string"},
+            "estimated_weight_grams": {"type": "number"},
+            "volume_food": {"type": "number"},
+        },
+        "required": ["food_item", "estimated_weight_grams", "volume_food"],
+    },
+}
+
+_decoder = json.JSONDecoder()
+_LEADING_NUMBER = re.compile(r"^\s*(\d+(?:\.\d*)?|\.\d+)")
+
+
+class FoodStreamParser:
+    """
+    Incremental parser for a JSON array of food objects. feed() text as it
+    arrives and get back the objects completed by it; close() when the reply is
+    over. complete is True once the closing ] has been seen.
+    """
+
+    def __init__(self):
+        self._buffer = ""
+        self._pos = 0
+        self._started = False
+        self.complete = False
+        self.items = []
+
+    def feed(self, text):
+        self._buffer += text
+        found = []
+        while not self.complete:
+            item = self._next_item()
+            if item is None:
+                break
+            found.append(item)
+        self.items.extend(found)
+        return found
+
+    def _skip(self, chars):
+        while self._pos < len(self._buffer) and self._buffer[self._pos] in chars:
+            self._pos += 1
+
+    def _next_item(self):
+        if not self._started:
+            start = self._buffer.find("[", self._pos)
+            if start < 0:
+                # Keep scanning from the end next time; nothing before it matters
+                self._pos = len(self._buffer)
+                return None
+            self._pos = start + 1
+            self._started = True
+
+        self._skip(" \t\r\n,")
+        if self._pos >= len(self._buffer):
+            return None
+        if self._buffer[self._pos] == "]":
+            self._pos += 1
+            self.complete = True
+            return None
+        try:
+            item, end = _decoder.raw_decode(self._buffer, self._pos)
+        except json.JSONDecodeError:
+            # Either incomplete (wait for more text) or garbage (close() gives up)
+            return None
+        self._pos = end
+        return item
+
+    def close(self):
+        """The reply is over. Returns (items, complete)."""
+        return self.items, self.complete
+
+
+def extract_json(text):
+    """
+    The first JSON value in text: bare, fenced or surrounded by prose. Returns
+    the parsed value, or raises ValueError.
+    """
+    text = text or ""
+    for match in re.finditer(r"[\[{]", text):
+        try:
+            value, _ = _decoder.raw_decode(text, match.start())
+        except json.JSONDecodeError:
+            continue
+        return value
+    raise ValueError("No JSON value found in model reply")
+
+
+def coerce_food(item):
+    """
+    A food entry in the schema's types, or None if it isn't usable. Weights sent
+    as strings ("120 g") are read up to the first non-number.
+    """
+    if not isinstance(item, dict):
+        return None
+    name = item.get("food_item")
+    if not isinstance(name, str) or not name.strip():
+        return None
+
+    food = dict(item)
+    food["food_item"] = name.strip()
+    for key in ("estimated_weight_grams", "volume_food"):
+        value = item.get(key)
+        if isinstance(value, bool):
+            value = None
+        elif isinstance(value, str):
+            number = _LEADING_NUMBER.match(value)
+            value = float(number.group(1)) if number else None
+        if key == "estimated_weight_grams" and not isinstance(value, (int, float)):
+            return None
+        if value is not None:
+            food[key] = value
+    return food
+
+
+def parse_foods(text):
+    """
+    Detected foods from a reply. Returns (foods, complete): complete is False if
+    the array was cut off or some entries were unusable, in which case foods only
+    holds the ones that could be recovered. Raises ValueError if there's no array.
+    """
+    parser = FoodStreamParser()
+    parser.feed(text or "")
+    items, complete = parser.close()
+
+    if not complete and not items:
+        # Maybe a single object, or an array wrapped in an object
+        value = extract_json(text)
+        if isinstance(value, dict):
+            nested = next((v for v in value.values() if isinstance(v, list)), None)
+            items, complete = (nested, True) if nested is not None else ([value], True)
+        elif isinstance(value, list):
+            items, complete = value, True
+        else:
+            raise ValueError("Model reply is not a list of foods")
+
+    foods = [coerce_food(item) for item in items]
+    usable = [food for food in foods if food is not None]
+    return usable, complete and len(usable) == len(foods)
+
+
+def repair_contents(reply_text):
+    """A text-only request asking the model to fix its own reply."""
+    return [
+        "The following was supposed to be a JSON array of objects with keys "
+        "'food_item' (string), 'estimated_weight_grams' (number) and 'volume_food' "
+        "(number), but it could not be parsed. Return only the corrected JSON array, "
+        "keeping every food and number it contains.",
+        reply_text or "",
+    ]
@@ -0,0 +1,277 @@
+# Runs model calls off the request thread.
+#
+# The model itself sits behind a backend (see model_backends.py): Gemini on Vertex
+# by default, or a fake server, an in-process stub or recorded replies. Each worker
+# process builds one backend (get_backend) and reuses it; the Vertex one keeps one
+# GenerativeModel, so the SDK's HTTP/gRPC connections are shared by every request
+# instead of being set up per call. warm_up() creates it at startup so the first
+# request doesn't pay for it.
+#
+# The Flask route hands its generate call to a bounded thread pool and waits with
+# a timeout, so a slow model call turns into a 504 instead of holding the worker
+# forever. The ASGI entry point (asgi.py) uses generate_async, which awaits the
+# backend's async API so one process can keep many analyses in flight.
+# generate_stream runs a streamed call on the same pool and hands the chunks over
+# as they arrive, with the timeout applied to the whole reply.
+#
+# Every call first goes through the admission controller (see admission.py), which
+# caps concurrency and call rate and raises ModelOverloaded when the wait queue is
+# full. A call the provider rejects for quota (ModelQuotaError) is retried after a
+# jittered exponential backoff, within the call's timeout; when the retries run
+# out it becomes ModelOverloaded with status 429.
+#
+# Configured with environment variables:
+#   MODEL_TIMEOUT          seconds to wait for a model response (default 120)
+#   MODEL_WORKERS          threads available for blocking model calls (default 32)
+#   MODEL_CONCURRENCY      max model calls in flight per worker (default 16)
+#   MODEL_QPS              max model calls started per second per worker; 0 for no
+#                          limit (default 0)
+#   MODEL_BURST            calls that may start back to back before MODEL_QPS
+#                          applies (default MODEL_QPS)
+#   MODEL_QUEUE_SIZE       calls that may wait for a slot; beyond that, 503 (default 64)
+#   MODEL_QUEUE_TIMEOUT    seconds a call may wait for a slot (default 10)
+#   MODEL_QUOTA_RETRIES    retries of a call rejected for quota (default 3)
+#   MODEL_QUOTA_BACKOFF    base backoff before the first retry, doubling each time
+#                          up to MODEL_QUOTA_BACKOFF_MAX (defaults 0.5 and 8 seconds)
+#   MODEL_WARMUP_PING      1 to send a count_tokens call during warm-up, which also
+#                          opens the connection to Vertex (default 0)
+#   MODEL_BACKEND and the backend settings are described in model_backends.py
+
+import asyncio
+import concurrent.futures
+import math
+import os
+import queue
+import random
+import threading
+import time
+
+import metrics
+from admission import AdmissionController, ModelOverloaded
+from model_backends import ImagePart, ModelBackendError, ModelQuotaError, TextResponse, make_backend
+
+MODEL_TIMEOUT = float(os.environ.get("MODEL_TIMEOUT", "120"))
+MODEL_WORKERS = int(os.environ.get("MODEL_WORKERS", "32"))
+MODEL_CONCURRENCY = int(os.environ.get("MODEL_CONCURRENCY", "16"))
+MODEL_QPS = float(os.environ.get("MODEL_QPS", "0"))
+MODEL_BURST = float(os.environ["MODEL_BURST"]) if os.environ.get("MODEL_BURST") else None
+MODEL_QUEUE_SIZE = int(os.environ.get("MODEL_QUEUE_SIZE", "64"))
+MODEL_QUEUE_TIMEOUT = float(os.environ.get("MODEL_QUEUE_TIMEOUT", "10"))
+MODEL_QUOTA_RETRIES = int(os.environ.get("MODEL_QUOTA_RETRIES", "3"))
+MODEL_QUOTA_BACKOFF = float(os.environ.get("MODEL_QUOTA_BACKOFF", "0.5"))
+MODEL_QUOTA_BACKOFF_MAX = float(os.environ.get("MODEL_QUOTA_BACKOFF_MAX", "8"))
+
+_executor = concurrent.futures.ThreadPoolExecutor(max_workers=MODEL_WORKERS, thread_name_prefix="gemini")
+# Shared by the blocking, streamed and async paths
+admission = AdmissionController(MODEL_CONCURRENCY, qps=MODEL_QPS, burst=MODEL_BURST,
+                                max_queue=MODEL_QUEUE_SIZE, queue_timeout=MODEL_QUEUE_TIMEOUT)
+
+_backend = None
+_backend_pid = None
+_backend_lock = threading.Lock()
+
+
+class ModelTimeout(Exception):
+    """The model didn't answer within the timeout."""
+
+
+def get_backend():
+    """
+    The worker's model backend, built from MODEL_BACKEND on first use. Rebuilt if
+    we're in a forked child, since the parent's connections can't be reused.
+    """
+    global _backend, _backend_pid
+    if _backend is not None and _backend_pid == os.getpid():
+        return _backend
+    with _backend_lock:
+        if _backend is None or _backend_pid != os.getpid():
+            _backend = make_backend(executor=_executor)
+            _backend_pid = os.getpid()
+    return _backend
+
+
+def set_backend(backend):
+    """Use this backend in this process from now on (benchmarks, scripts)."""
+    global _backend, _backend_pid
+    with _backend_lock:
+        _backend = backend
+        _backend_pid = os.getpid()
+
+
+def image_part(data, mime_type):
+    """An image for the model request; backends convert it to their own format."""
+    return ImagePart(data, mime_type)
+
+
+def warm_up():
+    """Create the model client up front (and optionally open the connection)."""
+    get_backend().warm_up()
+
+
+def _quota_backoff(error, attempt, deadline):
+    """
+    Seconds to wait before retrying a call rejected for quota: full jitter over an
+    exponential backoff, or longer if the provider asked for it. Raises
+    ModelOverloaded (429) once the retries are used up or the wait would pass the
+    deadline.
+    """
+    metrics.increment("model_quota_errors")
+    delay = random.uniform(0, min(MODEL_QUOTA_BACKOFF_MAX, MODEL_QUOTA_BACKOFF * 2 ** attempt))
+    delay = max(delay, error.retry_after or 0)
+    if attempt >= MODEL_QUOTA_RETRIES or time.monotonic() + delay >= deadline:
+        metrics.increment("model_quota_exhausted")
+        raise ModelOverloaded("Model quota exhausted; try again shortly", retry_after=max(1, math.ceil(delay)),
+                              status=429) from error
+    metrics.increment("model_quota_retries")
+    return delay
+
+
+def _call_model(contents, response_schema, deadline, admitted_at):
+    # Runs holding the admission slot generate() took; releases it when done
+    try:
+        backend = get_backend()
+        attempt = 0
+        while True:
+            try:
+                # The Vertex SDK sends the image and waits for the answer in one call, so
+                # this includes the upload time as well as the model's own latency
+                with metrics.timed("inference"):
+                    return backend.generate(contents, response_schema)
+            except ModelQuotaError as e:
+                time.sleep(_quota_backoff(e, attempt, deadline))
+            # A retry is another call against the rate limit, though it keeps its slot
+            time.sleep(admission.reserve_token(deadline))
+            attempt += 1
+    finally:
+        admission.release(admitted_at)
+
+
+def generate(contents, timeout=None, response_schema=None):
+    """
+    Blocking model call on the shared pool. With response_schema the model is asked
+    for JSON matching it (structured output). Raises ModelOverloaded if the call
+    isn't admitted, or ModelTimeout if no answer arrives in time; a call that hasn't
+    started yet is cancelled, and one that has is left to finish in the background
+    while the request returns.
+    """
+    timeout = MODEL_TIMEOUT if timeout is None else timeout
+    deadline = time.monotonic() + timeout
+    # Waits in this thread, so queued calls don't tie up the model pool
+    admitted_at = admission.acquire(timeout)
+    try:
+        future = _executor.submit(_call_model, contents, response_schema, deadline, admitted_at)
+    except BaseException:
+        admission.release(admitted_at)
+        raise
+    try:
+        return future.result(timeout=max(0.0, deadline - time.monotonic()))
+    except concurrent.futures.TimeoutError:
+        if future.cancel():
+            admission.release(None)
+        raise ModelTimeout(f"Model did not respond within {timeout:g} seconds")
+
+
+_STREAM_END = object()
+
+
+def _stream_model(contents, response_schema, chunks, cancelled, deadline, admitted_at):
+    backend = get_backend()
+    start = time.perf_counter()
+    first = True
+    try:
+        attempt = 0
+        while True:
+            try:
+                for chunk in backend.generate_stream(contents, response_schema):
+                    if first:
+                        metrics.record("first_chunk", time.perf_counter() - start)
+                        first = False
+                    if cancelled.is_set():
+                        return
+                    chunks.put(chunk)
+                return
+            except ModelQuotaError as e:
+                # Only a stream that hasn't started can be retried
+                if not first:
+                    raise
+                time.sleep(_quota_backoff(e, attempt, deadline))
+            time.sleep(admission.reserve_token(deadline))
+            attempt += 1
+    except Exception as e:
+        chunks.put(e)
+    finally:
+        metrics.record("inference", time.perf_counter() - start)
+        admission.release(admitted_at)
+        chunks.put(_STREAM_END)
+
+
+def generate_stream(contents, timeout=None, response_schema=None):
+    """
+    Streamed model call on the shared pool: yields the reply text chunk by chunk.
+    Raises ModelOverloaded if the call isn't admitted, or ModelTimeout if the whole
+    reply hasn't arrived in time. Closing the generator early (e.g. the client went
+    away) stops reading the model's stream.
+    """
+    timeout = MODEL_TIMEOUT if timeout is None else timeout
+    deadline = time.monotonic() + timeout
+    admitted_at = admission.acquire(timeout)
+    chunks = queue.Queue()
+    cancelled = threading.Event()
+    try:
+        future = _executor.submit(_stream_model, contents, response_schema, chunks, cancelled, deadline,
+                                  admitted_at)
+    except BaseException:
+        admission.release(admitted_at)
+        raise
+    try:
+        while True:
+            try:
+                chunk = chunks.get(timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Empty:
+                raise ModelTimeout(f"Model did not respond within {timeout:g} seconds")
+            if chunk is _STREAM_END:
+                return
+            if isinstance(chunk, Exception):
+                raise chunk
+            yield chunk
+    finally:
+        cancelled.set()
+        if future.cancel():
+            admission.release(None)
+
+
+async def generate_async(contents, timeout=None, response_schema=None):
+    """
+    Awaitable model call; the call is cancelled if the timeout expires. Raises
+    ModelOverloaded if it isn't admitted.
+    """
+    timeout = MODEL_TIMEOUT if timeout is None else timeout
+    deadline = time.monotonic() + timeout
+
+    async def call():
+        admitted_at = await admission.acquire_async(timeout)
+        try:
+            attempt = 0
+            while True:
+                start = time.perf_counter()
+                try:
+                    return await get_backend().generate_async(contents, response_schema)
+                except ModelQuotaError as e:
+                    delay = _quota_backoff(e, attempt, deadline)
+                finally:
+                    metrics.record("inference", time.perf_counter() - start)
+                await asyncio.sleep(delay)
+                await asyncio.sleep(admission.reserve_token(deadline))
+                attempt += 1
+        finally:
+            admission.release(admitted_at)
+
+    try:
+        return await asyncio.wait_for(call(), timeout)
+    except asyncio.TimeoutError:
+        raise ModelTimeout(f"Model did not respond within {timeout:g} seconds")
+
+
+def shutdown(wait=True):
+    """Stop taking new model calls; with wait=True, block until in-flight ones finish."""
+    _executor.shutdown(wait=wait)
@@ -0,0 +1,99 @@
+# Single-flight coalescing of identical in-flight model calls.
+#
+# When a client double-submits, or several people upload the same shared photo at
+# once, every request would otherwise make its own Gemini call: the analysis cache
+# only helps once the first call has finished. With SingleFlight the first request
+# for a key makes the call and concurrent requests for the same key wait for it and
+# share its result (or its exception). Keys are dropped as soon as the call ends,
+# so nothing is cached here. Per process: workers don't coalesce with each other.
+
+import asyncio
+import threading
+
+import metrics
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    do(key, fn) runs fn() unless a call for key is already running, in which case it
+    waits for that one. Returns (result, coalesced). do_async is the same for
+    coroutines, for callers on an event loop.
+    """
+
+    def __init__(self, counter="coalesced_requests"):
+        self.counter = counter
+        self.coalesced = 0
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._async_calls = {}
+
+    def _count(self):
+        with self._lock:
+            self.coalesced += 1
+        metrics.increment(self.counter)
+
+    def do(self, key, fn):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            self._count()
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = fn()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result, False
+
+    async def do_async(self, key, fn):
+        # Futures belong to one event loop, so flights are kept per loop
+        loop = asyncio.get_running_loop()
+        flight_key = (id(loop), key)
+        future = self._async_calls.get(flight_key)
+        if future is not None:
+            self._count()
+            # shield: a waiter being cancelled mustn't cancel the shared call
+            return await asyncio.shield(future), True
+
+        future = self._async_calls[flight_key] = loop.create_future()
+        try:
+            result = await fn()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            # Mark it retrieved, so a call nobody waited on doesn't log a warning
+            future.exception()
+            raise
+        else:
+            future.set_result(result)
+        finally:
+            del self._async_calls[flight_key]
+        return result, False
+
+    def stats(self):
+        with self._lock:
+            return {
+                "in_flight": len(self._calls) + len(self._async_calls),
+                "coalesced": self.coalesced,
+            }